@@ -1,16 +1,32 @@
 from datetime import datetime, timedelta
 from fastapi.responses import HTMLResponse
 from jose import jwt
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Depends, Query
 from pydantic import BaseModel, EmailStr
+from pymongo.errors import DuplicateKeyError
 from typing import Optional, List
-from passlib.hash import bcrypt
-from cloudinary_utils import upload_image_to_cloudinary
-from mongo_utils import *
-from models import predict_skin_type, predict_skin_issues
-from models import generate_routine
+from storage import upload_image, track_background_upload
+from upload_ingest import ingest_image_upload
+from mongo_async import (
+    create_user, get_user_by_email, get_user_by_username,
+    update_user_by_username, update_user_by_email,
+    USER_EXISTS_PROJECTION, LOGIN_PROJECTION, PROFILE_PROJECTION,
+)
+from models import predict_skin_type_async, predict_skin_issues
+from routines import generate_routine
+import asyncio
+import queue
 import random
-from your_email_module import send_verification_email, send_password_reset_email
+import time
+from your_email_module import (
+    send_verification_email, send_password_reset_email, email_queue, EMAIL_RETRY_AFTER_SECONDS,
+)
+from executor import run_blocking
+from tokens import (
+    JWT_SECRET_KEY, SESSION_TOKEN_TYPES, issue_tokens, decode_token,
+    optional_token_claims, check_token_subject, REFRESH_TOKEN_TYPE,
+)
+from passwords import hash_password, verify_password
 import logging
 import os
 
@@ -19,7 +35,6 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Verify JWT_SECRET_KEY
-JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 if not JWT_SECRET_KEY:
     logger.error("JWT_SECRET_KEY is not set")
     raise ValueError("JWT_SECRET_KEY is not set")
@@ -29,6 +44,15 @@ JWT_EXPIRY_MINUTES = 30  # Link expires in 30 mins
 auth_router = APIRouter(prefix="/auth")
 logger.info("Initializing auth_router with prefix=/auth")
 
+def _email_backlog_error():
+    """503 for when the outbound email queue is at EMAIL_QUEUE_MAX."""
+    logger.warning("Email queue full, rejecting request that needs to send email")
+    return HTTPException(
+        status_code=503,
+        detail="Email service is busy, please retry shortly",
+        headers={"Retry-After": EMAIL_RETRY_AFTER_SECONDS},
+    )
+
 # --- Pydantic Schemas ---
 class UserCreate(BaseModel):
     username: str
@@ -66,30 +90,58 @@ class SkinDetails(BaseModel):
 class EmailSchema(BaseModel):
     email: EmailStr
 
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
 # --- Routes ---
 
 @auth_router.post("/login")
-def login(user: UserLogin):
+async def login(user: UserLogin):
     logger.info(f"Login attempt for {user.email}")
     try:
-        existing = get_user_by_email(user.email)
-        if not existing or not bcrypt.verify(user.password, existing["password"]):
+        existing = await get_user_by_email(user.email, LOGIN_PROJECTION)
+        if not existing:
             logger.warning(f"Invalid credentials for {user.email}")
             raise HTTPException(status_code=401, detail="Invalid credentials")
         if "password" not in existing:
             logger.error(f"User data corrupted for {user.email}: password missing")
             raise HTTPException(status_code=500, detail="User data is corrupted. Password missing.")
+        matches, new_hash = await verify_password(user.password, existing["password"])
+        if not matches:
+            logger.warning(f"Invalid credentials for {user.email}")
+            raise HTTPException(status_code=401, detail="Invalid credentials")
+        if new_hash:
+            # Stored hash was made with a different BCRYPT_ROUNDS; upgrade it while we have the password
+            await update_user_by_email(user.email, {"password": new_hash})
+            logger.info(f"Rehashed password for {user.email} with current cost")
         logger.info(f"Login successful for {user.email}")
-        return {"username": existing["username"], "email": existing["email"]}
+        return {
+            "username": existing["username"],
+            "email": existing["email"],
+            **issue_tokens(existing["username"], existing["email"]),
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Login failed for {user.email}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Login failed: {str(e)}")
 
+@auth_router.post("/refresh")
+async def refresh_tokens(data: RefreshTokenRequest):
+    claims = decode_token(data.refresh_token, expected_type=REFRESH_TOKEN_TYPE)
+    # Refreshing is rare enough to re-check that the account still exists
+    user = await get_user_by_username(claims["sub"], USER_EXISTS_PROJECTION)
+    if not user:
+        logger.warning(f"Refresh token for missing user: {claims['sub']}")
+        raise HTTPException(status_code=401, detail="Invalid token")
+    logger.info(f"Tokens refreshed for {claims['sub']}")
+    return {"username": claims["sub"], "email": claims.get("email"), **issue_tokens(claims["sub"], claims.get("email"))}
+
 @auth_router.post("/forgot-password")
-def forgot_password(data: EmailSchema):
+async def forgot_password(data: EmailSchema):
     logger.info(f"Forgot password request for {data.email}")
     try:
-        user = get_user_by_email(data.email)
+        user = await get_user_by_email(data.email)
         if not user:
             logger.warning(f"User not found: {data.email}")
             raise HTTPException(status_code=404, detail="User not found")
@@ -98,6 +150,7 @@ def forgot_password(data: EmailSchema):
         reset_token = jwt.encode(
             {
                 "email": data.email,
+                "type": "password_reset",
                 "exp": datetime.utcnow() + timedelta(minutes=JWT_EXPIRY_MINUTES)
             },
             JWT_SECRET_KEY,
@@ -107,10 +160,15 @@ def forgot_password(data: EmailSchema):
         # Construct reset link
         reset_link = f"https://skiniq-backend.onrender.com/static/reset_password.html?token={reset_token}"
 
-        # Send reset email
-        send_password_reset_email(data.email, user["username"], reset_link)
+        # Queue reset email; delivery happens on the email sender threads
+        try:
+            send_password_reset_email(data.email, user["username"], reset_link)
+        except queue.Full:
+            raise _email_backlog_error()
         logger.info(f"Password reset email sent to {data.email}")
         return {"message": "Reset password link sent to your email"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Forgot password failed for {data.email}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Forgot password failed: {str(e)}")
@@ -129,12 +187,13 @@ async def serve_reset_password_page():
         raise HTTPException(status_code=500, detail=f"Error serving reset password page: {str(e)}")
 
 @auth_router.post("/reset-password")
-def reset_password(data: ResetPassword):
+async def reset_password(data: ResetPassword):
     logger.info("Reset password request")
     try:
         payload = jwt.decode(data.token, JWT_SECRET_KEY, algorithms=["HS256"])
         email = payload.get("email")
-        if not email:
+        # Session tokens also carry an email claim; they must not work as reset links
+        if not email or payload.get("type") in SESSION_TOKEN_TYPES:
             logger.warning("Invalid token: no email in payload")
             raise HTTPException(status_code=400, detail="Invalid token")
     except Exception:
@@ -142,49 +201,72 @@ def reset_password(data: ResetPassword):
         raise HTTPException(status_code=400, detail="Invalid or expired token")
 
     try:
-        user = get_user_by_email(email)
+        user = await get_user_by_email(email)
         if not user:
             logger.warning(f"User not found for email: {email}")
             raise HTTPException(status_code=404, detail="User not found")
 
-        hashed_pwd = bcrypt.hash(data.new_password)
-        update_user_by_username(user["username"], {"password": hashed_pwd})
+        hashed_pwd = await hash_password(data.new_password)
+        await update_user_by_username(user["username"], {"password": hashed_pwd})
         logger.info(f"Password reset successful for {email}")
         return {"message": "Password reset successful"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Password reset failed for {email}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Password reset failed: {str(e)}")
 
 @auth_router.post("/signup")
-def signup(user: UserCreate):
+async def signup(user: UserCreate):
     logger.info(f"Received signup request for email: {user.email}")
     try:
-        if get_user_by_email(user.email):
+        if await get_user_by_email(user.email, USER_EXISTS_PROJECTION):
             logger.warning(f"Email already exists: {user.email}")
             raise HTTPException(status_code=400, detail="Email already exists")
-        
+        # Refuse before the account exists, so a retry isn't met with "Email already exists"
+        if email_queue.is_full():
+            raise _email_backlog_error()
+
         user_data = user.dict()
-        user_data["password"] = bcrypt.hash(user.password)
+        user_data["password"] = await hash_password(user.password)
         user_data["email_verified"] = False
 
         otp = random.randint(100000, 999999)
         user_data["otp"] = otp
         
-        create_user(user_data)
-        
-        send_verification_email(user.email, otp, user.username)
-        
+        try:
+            await create_user(user_data)
+        except DuplicateKeyError as e:
+            # Taken username, or a concurrent signup with the same email won the unique index
+            key_pattern = (getattr(e, "details", None) or {}).get("keyPattern") or {}
+            field = "Username" if "username" in key_pattern or "username" in str(e) else "Email"
+            logger.warning(f"Signup rejected for {user.email}: {field.lower()} already exists")
+            raise HTTPException(status_code=400, detail=f"{field} already exists")
+
+        try:
+            send_verification_email(user.email, otp, user.username)
+        except queue.Full:
+            # The queue filled up after the check above; the account is kept, so point the
+            # client at /auth/send-otp rather than failing a signup that did succeed
+            logger.warning(f"Signup for {user.email} succeeded but the verification email could not be queued")
+            return {
+                "message": "Signup successful, but the OTP email could not be sent. Request a new OTP via /auth/send-otp.",
+                "otp_sent": False,
+            }
+
         logger.info(f"Signup successful for {user.email}, OTP sent")
         return {"message": "Signup successful. OTP sent to email."}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Signup failed for {user.email}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Signup failed: {str(e)}")
 
 @auth_router.post("/verify-otp")
-def verify_otp(data: VerifyOtpRequest):
+async def verify_otp(data: VerifyOtpRequest):
     logger.info(f"Verifying OTP for {data.email}")
     try:
-        user = get_user_by_email(data.email)
+        user = await get_user_by_email(data.email)
         if not user:
             logger.warning(f"User not found: {data.email}")
             raise HTTPException(status_code=404, detail="User not found")
@@ -193,9 +275,11 @@ def verify_otp(data: VerifyOtpRequest):
             logger.warning(f"Invalid OTP for {data.email}: stored={user.get('otp')}, received={data.otp}")
             raise HTTPException(status_code=400, detail="Invalid OTP")
 
-        update_user_by_email(data.email, {"email_verified": True})
+        await update_user_by_email(data.email, {"email_verified": True})
         logger.info(f"Email verified for {data.email}")
         return {"message": "Email verified successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"OTP verification failed for {data.email}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"OTP verification failed: {str(e)}")
@@ -205,59 +289,150 @@ async def send_otp(user: EmailSchema):
     logger.info(f"Send OTP request for {user.email}")
     try:
         otp = random.randint(100000, 999999)
-        existing_user = get_user_by_email(user.email)
+        existing_user = await get_user_by_email(user.email)
 
         if existing_user:
-            update_user_by_email(user.email, {"otp": otp})
-            send_verification_email(user.email, str(otp), existing_user["username"])
+            if email_queue.is_full():
+                raise _email_backlog_error()
+            await update_user_by_email(user.email, {"otp": otp})
+            try:
+                send_verification_email(user.email, str(otp), existing_user["username"])
+            except queue.Full:
+                raise _email_backlog_error()
             logger.info(f"OTP {otp} sent to {user.email}")
         else:
             logger.warning(f"User not found: {user.email}")
             raise HTTPException(status_code=404, detail="User not found")
 
         return {"message": "OTP sent"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Send OTP failed for {user.email}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Send OTP failed: {str(e)}")
 
+async def _upload_photo_variants(upload):
+    """Store the original image and its thumbnail concurrently; returns (image_url, thumbnail_url)."""
+    thumbnail = await run_blocking(upload.thumbnail)
+    return await asyncio.gather(upload_image(upload.open), upload_image(thumbnail))
+
+def _newest_photo_filter(started_at):
+    """Write only if no skin photo newer than started_at has been recorded, so uploads finishing
+    out of order can't replace a newer photo with an older one."""
+    return {"$or": [
+        {"profile_image_started_at": {"$exists": False}},
+        {"profile_image_started_at": {"$lte": started_at}},
+    ]}
+
+async def _save_skin_photo_fields(username, started_at, data):
+    result = await update_user_by_username(
+        username, {**data, "profile_image_started_at": started_at}, match=_newest_photo_filter(started_at)
+    )
+    if not result.matched_count:
+        logger.info(f"Skipped skin photo write for {username}: a newer photo was uploaded meanwhile")
+
+async def _finish_skin_photo_upload(username, storage_task, upload, started_at):
+    try:
+        image_url, thumbnail_url = await storage_task
+        await _save_skin_photo_fields(username, started_at, {
+            "profile_image": image_url,
+            "profile_thumbnail": thumbnail_url,
+            "profile_image_status": "ready",
+        })
+        logger.info(f"Background skin photo upload finished for {username}")
+    except Exception as e:
+        logger.error(f"Background skin photo upload failed for {username}: {str(e)}")
+        await _save_skin_photo_fields(username, started_at, {"profile_image_status": "failed"})
+    finally:
+        upload.close()
+
 @auth_router.post("/upload-skin-photo/{username}")
-def upload_skin_photo(username: str, file: UploadFile = File(...)):
+async def upload_skin_photo(
+    username: str,
+    file: UploadFile = File(...),
+    wait_for_upload: bool = Query(True, description="False returns the prediction before the image is stored; "
+                                                    "profile_image is filled in when the upload finishes"),
+    claims: Optional[dict] = Depends(optional_token_claims),
+):
     logger.info(f"Uploading skin photo for {username}")
     try:
-        # Upload to Cloudinary
-        image_url = upload_image_to_cloudinary(file.file)
-
-        # Predict skin type
-        file.file.seek(0)
-        skin_type = predict_skin_type(file.file)
+        check_token_subject(username, claims)
+        started_at = time.time()
+        upload = await ingest_image_upload(file)
+
+        # Storage upload (original + thumbnail) and inference run concurrently from the same buffer
+        storage_task = asyncio.create_task(_upload_photo_variants(upload))
+        try:
+            with upload.open() as image_file:
+                skin_type = await predict_skin_type_async(image_file, upload.sha256)
+        except BaseException:
+            storage_task.cancel()
+            upload.close()
+            raise
+
+        if not wait_for_upload:
+            try:
+                await _save_skin_photo_fields(username, started_at, {
+                    "predicted_skin_type": skin_type,
+                    "profile_image_status": "pending",
+                    "recommended_routine": None  # recomputed and persisted on the next profile read
+                })
+            except BaseException:
+                storage_task.cancel()
+                upload.close()
+                raise
+            track_background_upload(asyncio.create_task(
+                _finish_skin_photo_upload(username, storage_task, upload, started_at)
+            ))
+            logger.info(f"Skin type predicted for {username}: {skin_type}, photo upload continuing in background")
+            return {
+                "message": "Skin type predicted; photo upload in progress",
+                "image_url": None,
+                "image_status": "pending",
+                "predicted_skin_type": skin_type
+            }
+
+        try:
+            image_url, thumbnail_url = await storage_task
+        finally:
+            upload.close()
 
         # Save to DB
-        update_user_by_username(username, {
+        await _save_skin_photo_fields(username, started_at, {
             "profile_image": image_url,
-            "predicted_skin_type": skin_type
+            "profile_thumbnail": thumbnail_url,
+            "profile_image_status": "ready",
+            "predicted_skin_type": skin_type,
+            "recommended_routine": None  # recomputed and persisted on the next profile read
         })
 
         logger.info(f"Skin photo uploaded for {username}, skin type: {skin_type}")
         return {
             "message": "Skin photo uploaded and skin type predicted",
             "image_url": image_url,
+            "thumbnail_url": thumbnail_url,
+            "image_status": "ready",
             "predicted_skin_type": skin_type
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Skin photo upload failed for {username}: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @auth_router.post("/update-skin-details/{username}")
-def update_skin_details(username: str, details: SkinDetails):
+async def update_skin_details(username: str, details: SkinDetails, claims: Optional[dict] = Depends(optional_token_claims)):
     logger.info(f"Updating skin details for {username}")
     try:
+        check_token_subject(username, claims)
         # Predict skin issues
-        predicted_issues = predict_skin_issues(details.skinDescription)
+        predicted_issues = await run_blocking(predict_skin_issues, details.skinDescription)
 
         # Save to DB
-        update_user_by_username(username, {
+        await update_user_by_username(username, {
             "skin_details": details.dict(),
-            "predicted_skin_issues": predicted_issues
+            "predicted_skin_issues": predicted_issues,
+            "recommended_routine": None  # recomputed and persisted on the next profile read
         })
 
         logger.info(f"Skin details updated for {username}")
@@ -265,15 +440,18 @@ def update_skin_details(username: str, details: SkinDetails):
             "message": "Skin details updated and issues predicted",
             "predicted_skin_issues": predicted_issues
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Skin details update failed for {username}: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @auth_router.get("/profile/{username}")
-def get_profile(username: str):
+async def get_profile(username: str, claims: Optional[dict] = Depends(optional_token_claims)):
     logger.info(f"Fetching profile for {username}")
     try:
-        user = get_user_by_username(username)
+        check_token_subject(username, claims)
+        user = await get_user_by_username(username, PROFILE_PROJECTION)
         if not user:
             logger.warning(f"User not found: {username}")
             raise HTTPException(status_code=404, detail="User not found")
@@ -281,30 +459,49 @@ def get_profile(username: str):
         predicted_skin_type = user.get("predicted_skin_type", "")
         predicted_issues = user.get("predicted_skin_issues", [])
 
-        routine = generate_routine(predicted_skin_type, predicted_issues)
+        routine = user.get("recommended_routine")
+        if routine is None:
+            # Not persisted yet (older users, or inputs changed since): compute once and store it.
+            # The read may be stale, so only store it if the routine is still unset and the
+            # inputs are exactly the ones it was computed from.
+            routine = generate_routine(predicted_skin_type, predicted_issues)
+            await update_user_by_username(username, {"recommended_routine": routine}, match={
+                "recommended_routine": None,
+                "predicted_skin_type": user.get("predicted_skin_type"),
+                "predicted_skin_issues": user.get("predicted_skin_issues"),
+            })
 
         logger.info(f"Profile fetched for {username}")
         return {
             "username": user["username"],
             "email": user["email"],
             "profile_image": user.get("profile_image"),
+            "profile_thumbnail": user.get("profile_thumbnail"),
+            "profile_image_status": user.get("profile_image_status"),
             "skin_details": user.get("skin_details", {}),
             "predicted_skin_type": predicted_skin_type,
             "predicted_skin_issues": predicted_issues,
             "recommended_routine": routine
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Profile fetch failed for {username}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Profile fetch failed: {str(e)}")
 
 @auth_router.post("/update-profile-image/{username}")
-def update_profile_image(username: str, file: UploadFile = File(...)):
+async def update_profile_image(username: str, file: UploadFile = File(...), claims: Optional[dict] = Depends(optional_token_claims)):
     logger.info(f"Updating profile image for {username}")
     try:
-        image_url = upload_image_to_cloudinary(file.file)
-        update_user_by_username(username, {"profile_image": image_url})
+        check_token_subject(username, claims)
+        with await ingest_image_upload(file) as upload:
+            image_url = await upload_image(upload.open)
+        # Counts as the newest photo, so an older skin photo still uploading won't replace it
+        await update_user_by_username(username, {"profile_image": image_url, "profile_image_started_at": time.time()})
         logger.info(f"Profile image updated for {username}")
         return {"message": "Profile image updated", "profile_image": image_url}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Profile image update failed for {username}: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,254 @@
+"""Benchmark the skin analysis pipeline in-process.
+
+Usage:
+    python bench_inference.py [--requests 200] [--concurrency 1 4 16] [--output baseline.json]
+                              [--compare previous.json] [--max-regression 20]
+
+Measures predict_skin_type, predict_skin_issues and generate_routine directly, and the
+/skin/analyze and /skin/questionnaire routes through an in-process ASGI client with
+MongoDB replaced by local_mongo.py and uploads stored on the local filesystem. Images are
+synthetic JPEGs and descriptions are sampled from Dataset/augmented_datasets.csv, both from
+a fixed seed. Reports latency percentiles, throughput per concurrency level and peak RSS as
+JSON; --compare prints the change against an earlier report and exits non-zero when p95
+latency or throughput regresses by more than --max-regression percent.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger("bench_inference")
+
+DATASET_PATH = os.path.join("Dataset", "augmented_datasets.csv")
+BENCH_USERNAME = "bench_user"
+
+def load_descriptions(path=DATASET_PATH):
+    with open(path, newline="", encoding="utf-8") as f:
+        return [row["symptoms"].strip() for row in csv.DictReader(f) if row.get("symptoms", "").strip()]
+
+def make_images(count, seed, size=(640, 480)):
+    """Distinct synthetic JPEGs, so the prediction cache can't short-circuit inference."""
+    import numpy as np
+    from PIL import Image
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        pixels = rng.integers(0, 256, size=(size[1], size[0], 3), dtype=np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format="JPEG", quality=85)
+        images.append(buffer.getvalue())
+    return images
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def summarize(latencies, elapsed, errors=0):
+    latencies = sorted(latencies)
+
+    def percentile(p):
+        if not latencies:
+            return None
+        index = min(len(latencies) - 1, max(0, int(round(p / 100 * len(latencies))) - 1))
+        return latencies[index] * 1000
+
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "seconds": elapsed,
+        "throughput_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(50),
+        "p90_ms": percentile(90),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+        "max_ms": latencies[-1] * 1000 if latencies else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def bench_sync(func, inputs, concurrency):
+    def call(item):
+        started = time.perf_counter()
+        func(item)
+        return time.perf_counter() - started
+
+    latencies, errors = [], 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(call, item) for item in inputs]
+        for future in futures:
+            try:
+                latencies.append(future.result())
+            except Exception as e:
+                errors += 1
+                logger.warning(f"{getattr(func, '__name__', func)} failed: {e}")
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+async def bench_route(send, inputs, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def call(item):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            response = await send(item)
+            if response.status_code >= 400:
+                errors += 1
+                logger.warning(f"Route returned {response.status_code}: {response.text[:200]}")
+            else:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(call(item) for item in inputs))
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+def build_app(storage_dir):
+    from fastapi import FastAPI
+    from local_mongo import install_in_memory_mongo
+    from storage import LocalFileStorage, set_storage_backend
+    from skin_analysis import skin_router
+
+    db = install_in_memory_mongo()
+    set_storage_backend(LocalFileStorage(root=storage_dir))
+    app = FastAPI()
+    app.include_router(skin_router)
+    return app, db
+
+async def run_routes(app, db, images, descriptions, concurrency_levels, results):
+    import httpx
+
+    await db["users"].insert_one({"username": BENCH_USERNAME, "email": "bench@example.com"})
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        async def analyze(image):
+            return await client.post(
+                "/skin/analyze",
+                params={"username": BENCH_USERNAME},
+                files={"file": ("bench.jpg", image, "image/jpeg")},
+            )
+
+        async def questionnaire(description):
+            return await client.post("/skin/questionnaire", json={
+                "username": BENCH_USERNAME,
+                "gender": "female",
+                "age": 30,
+                "skinType": "combination",
+                "skinConcerns": [],
+                "skinConditionDiseases": [],
+                "skinBreakouts": "sometimes",
+                "skinDescription": description,
+            })
+
+        for concurrency in concurrency_levels:
+            results["route:/skin/analyze"][str(concurrency)] = await bench_route(analyze, images, concurrency)
+            results["route:/skin/questionnaire"][str(concurrency)] = await bench_route(questionnaire, descriptions, concurrency)
+
+def compare(current, baseline, max_regression):
+    regressions = []
+    for name, levels in current["results"].items():
+        for concurrency, stats in levels.items():
+            previous = baseline.get("results", {}).get(name, {}).get(concurrency)
+            if not previous or not previous.get("p95_ms") or not stats.get("p95_ms"):
+                continue
+            p95_change = (stats["p95_ms"] - previous["p95_ms"]) / previous["p95_ms"] * 100
+            throughput_change = (
+                (stats["throughput_per_second"] - previous["throughput_per_second"]) / previous["throughput_per_second"] * 100
+                if previous["throughput_per_second"] else 0.0
+            )
+            print(f"{name} @ {concurrency}: p95 {p95_change:+.1f}%, throughput {throughput_change:+.1f}%")
+            if p95_change > max_regression or -throughput_change > max_regression:
+                regressions.append(f"{name} @ {concurrency}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark skin analysis inference and routes.")
+    parser.add_argument("--requests", type=int, default=200, help="Calls per benchmark and concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-routes", action="store_true")
+    parser.add_argument("--keep-prediction-cache", action="store_true",
+                        help="Leave the prediction cache on (default: disabled so every image is inferred)")
+    parser.add_argument("--output", help="Write the JSON report here (default: stdout)")
+    parser.add_argument("--compare", help="Earlier JSON report to compare against")
+    parser.add_argument("--max-regression", type=float, default=20.0, help="Allowed p95/throughput regression, percent")
+    args = parser.parse_args()
+
+    if not args.keep_prediction_cache:
+        os.environ["PREDICTION_CACHE_TTL_SECONDS"] = "0"
+        os.environ["PREDICTION_CACHE_SHARED_URL"] = ""
+
+    import models
+    from routines import generate_routine
+
+    rng = random.Random(args.seed)
+    all_descriptions = load_descriptions()
+    descriptions = [rng.choice(all_descriptions) for _ in range(args.requests)]
+    images = make_images(args.requests, args.seed)
+    routine_inputs = [
+        (rng.choice(models.SKIN_TYPE_LABELS), models.predict_skin_issues(description))
+        for description in descriptions[:min(50, len(descriptions))]
+    ]
+
+    models.warm_up_models()
+    results = {name: {} for name in (
+        "predict_skin_type", "predict_skin_issues", "generate_routine",
+        "route:/skin/analyze", "route:/skin/questionnaire",
+    )}
+    for concurrency in args.concurrency:
+        results["predict_skin_type"][str(concurrency)] = bench_sync(models.predict_skin_type, images, concurrency)
+        results["predict_skin_issues"][str(concurrency)] = bench_sync(models.predict_skin_issues, descriptions, concurrency)
+        results["generate_routine"][str(concurrency)] = bench_sync(
+            lambda item: generate_routine(*item), [rng.choice(routine_inputs) for _ in range(args.requests)], concurrency
+        )
+
+    if not args.skip_routes:
+        with tempfile.TemporaryDirectory() as storage_dir:
+            app, db = build_app(storage_dir)
+            asyncio.run(run_routes(app, db, images, descriptions, args.concurrency, results))
+    else:
+        results = {name: levels for name, levels in results.items() if not name.startswith("route:")}
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "model_version": models.MODEL_VERSION,
+            "inference_backend": models.INFERENCE_BACKEND,
+            "requests": args.requests,
+            "seed": args.seed,
+            "prediction_cache": args.keep_prediction_cache,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+        "results": results,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote benchmark report to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.max_regression)
+        if regressions:
+            print(f"Regressions beyond {args.max_regression}%: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
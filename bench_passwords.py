@@ -0,0 +1,68 @@
+"""Benchmark login password verification throughput.
+
+Usage:
+    python bench_passwords.py [--logins 200] [--rounds 12] [--workers 1 2 4] [--output report.json]
+
+Runs the same bcrypt verification the /auth/login route performs through a process pool
+of each requested size and reports logins/sec overall and per worker process (core).
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from passwords import hash_password_sync, verify_password_sync, BCRYPT_ROUNDS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BENCH_PASSWORD = "correct horse battery staple"
+
+def run(logins, rounds, workers):
+    hashed = hash_password_sync(BENCH_PASSWORD, rounds)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        # Warm the pool so process start-up is not counted
+        list(pool.map(verify_password_sync, [BENCH_PASSWORD] * workers, [hashed] * workers, [rounds] * workers))
+        started = time.perf_counter()
+        results = list(pool.map(verify_password_sync, [BENCH_PASSWORD] * logins, [hashed] * logins, [rounds] * logins))
+        elapsed = time.perf_counter() - started
+    if not all(matches for matches, _ in results):
+        raise RuntimeError("Password verification failed during benchmark")
+    logins_per_second = logins / elapsed
+    return {
+        "workers": workers,
+        "rounds": rounds,
+        "logins": logins,
+        "seconds": elapsed,
+        "logins_per_second": logins_per_second,
+        "logins_per_second_per_core": logins_per_second / workers,
+        "mean_latency_ms": elapsed / logins * workers * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure bcrypt login verification throughput.")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=BCRYPT_ROUNDS)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    args = parser.parse_args()
+
+    report = {"cpu_count": os.cpu_count(), "results": []}
+    for workers in sorted(set(args.workers)):
+        result = run(args.logins, args.rounds, workers)
+        report["results"].append(result)
+        logger.info(
+            f"{workers} workers, {args.rounds} rounds: {result['logins_per_second']:.1f} logins/s "
+            f"({result['logins_per_second_per_core']:.1f}/s per core)"
+        )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class TTLCache:
+    """Thread-safe in-process LRU cache whose entries also expire after ttl_seconds."""
+
+    def __init__(self, max_size=1024, ttl_seconds=3600):
+        self.max_size = max(1, int(max_size))
+        self.ttl_seconds = float(ttl_seconds)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+class SharedCache(ABC):
+    """Cache tier shared between processes; values are stored via serializer.dumps/loads (json by default)."""
+
+    name = "base"
+
+    @abstractmethod
+    def get(self, key):
+        raise NotImplementedError
+
+    @abstractmethod
+    def set(self, key, value, ttl_seconds):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, key):
+        raise NotImplementedError
+
+class InMemorySharedCache(SharedCache):
+    """Local stand-in for the shared tier, for tests and single-process runs."""
+
+    name = "memory"
+
+    def __init__(self, serializer=json):
+        self.serializer = serializer
+        self._cache = TTLCache(max_size=100000, ttl_seconds=float("inf"))
+
+    def get(self, key):
+        item = self._cache.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at <= time.time():
+            self._cache.delete(key)
+            return None
+        return self.serializer.loads(value)
+
+    def set(self, key, value, ttl_seconds):
+        self._cache.set(key, (self.serializer.dumps(value), time.time() + ttl_seconds))
+
+    def delete(self, key):
+        self._cache.delete(key)
+
+class RedisSharedCache(SharedCache):
+    name = "redis"
+
+    def __init__(self, url, prefix="skiniq:", serializer=json):
+        import redis  # optional dependency, only needed when a shared cache URL is configured
+        self.prefix = prefix
+        self.serializer = serializer
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def get(self, key):
+        value = self._client.get(self.prefix + key)
+        return self.serializer.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl_seconds):
+        self._client.set(self.prefix + key, self.serializer.dumps(value), ex=max(1, int(ttl_seconds)))
+
+    def delete(self, key):
+        self._client.delete(self.prefix + key)
+
+def create_shared_cache(url, prefix="skiniq:", serializer=json):
+    """Build the shared tier from a URL: "memory://" for the local stand-in, redis:// for Redis."""
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        return InMemorySharedCache(serializer=serializer)
+    try:
+        return RedisSharedCache(url, prefix=prefix, serializer=serializer)
+    except ImportError:
+        logger.warning("redis package is not installed; shared cache tier disabled")
+    except Exception as e:
+        logger.warning(f"Could not set up shared cache at {url}: {e}")
+    return None
+
+class TieredCache:
+    """In-process TTLCache in front of an optional SharedCache.
+
+    A shared tier failure is logged and treated as a miss so the cache never fails a request.
+    """
+
+    def __init__(self, local, shared=None):
+        self.local = local
+        self.shared = shared
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.shared_errors = 0
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None or self.shared is None:
+            return value
+        try:
+            value = self.shared.get(key)
+        except Exception as e:
+            self.shared_errors += 1
+            logger.warning(f"Shared cache get failed: {e}")
+            return None
+        if value is None:
+            self.shared_misses += 1
+            return None
+        self.shared_hits += 1
+        self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value, self.local.ttl_seconds)
+            except Exception as e:
+                self.shared_errors += 1
+                logger.warning(f"Shared cache set failed: {e}")
+
+    def delete(self, key):
+        self.local.delete(key)
+        if self.shared is not None:
+            try:
+                self.shared.delete(key)
+            except Exception as e:
+                self.shared_errors += 1
+                logger.warning(f"Shared cache delete failed: {e}")
+
+    def stats(self):
+        stats = {"local": self.local.stats()}
+        if self.shared is not None:
+            stats["shared"] = {
+                "backend": self.shared.name,
+                "hits": self.shared_hits,
+                "misses": self.shared_misses,
+                "errors": self.shared_errors,
+            }
+        return stats
@@ -5,6 +5,7 @@ load_dotenv()
 import cloudinary
 import cloudinary.uploader
 import os
+from metrics import timed
 
 cloudinary.config(
     cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
@@ -12,6 +13,7 @@ cloudinary.config(
     api_secret=os.getenv("CLOUDINARY_API_SECRET")
 )
 
+@timed("cloudinary_upload")
 def upload_image_to_cloudinary(file_data, filename=None):
     result = cloudinary.uploader.upload(file_data, public_id=filename or None)
     return result["secure_url"]
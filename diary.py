@@ -1,60 +1,96 @@
-from fastapi import APIRouter, File, UploadFile, Form, HTTPException
-from typing import List
+from fastapi import APIRouter, File, UploadFile, Form, HTTPException, Query, Depends
+from typing import List, Optional
 import logging
 from datetime import datetime
-from cloudinary_utils import upload_image_to_cloudinary
-from mongo_utils import get_user_by_username, update_user_by_username
+from bson import ObjectId
+from storage import upload_images
+from mongo_async import save_diary_entry, get_user_diary_entries
+from tokens import optional_token_claims, ensure_user_exists
 
 diary_router = APIRouter()
 logger = logging.getLogger(__name__)
 
+DIARY_PAGE_DEFAULT_LIMIT = 20
+DIARY_PAGE_MAX_LIMIT = 100
+
+def serialize_diary_entry(entry):
+    entry = dict(entry)
+    entry["id"] = str(entry.pop("_id"))
+    return entry
+
 @diary_router.post("/diary_entry")
 async def create_diary_entry(
     username: str = Form(...),
     date: str = Form(...),
     text: str = Form(...),
     file: List[UploadFile] = File(...),
+    claims: Optional[dict] = Depends(optional_token_claims),
 ):
     try:
-        user = get_user_by_username(username)
-        if not user:
-            logger.warning(f"User not found: {username}")
-            raise HTTPException(status_code=404, detail="User not found")
+        # A valid bearer token for this user stands in for the database existence check
+        await ensure_user_exists(username, claims)
 
-        photo_urls = []
-        for photo in file:
-            photo_url = upload_image_to_cloudinary(photo.file, filename=photo.filename)
-            photo_urls.append(photo_url)
+        uploads = await upload_images([(photo.file, photo.filename) for photo in file])
+        photo_urls = [upload["url"] for upload in uploads if upload["url"]]
+        failed_uploads = [
+            {"filename": upload["filename"], "error": upload["error"]}
+            for upload in uploads if upload["error"]
+        ]
+        if failed_uploads:
+            logger.warning(f"{len(failed_uploads)} of {len(uploads)} diary photos failed to upload for {username}")
 
         diary_entry = {
+            "username": username,
             "date": date,
             "text": text,
             "photos": photo_urls,
             "created_at": datetime.utcnow().isoformat(),
         }
 
-        if "diary_entries" not in user:
-            user["diary_entries"] = []
-        user["diary_entries"].append(diary_entry)
-
-        update_user_by_username(username, {"diary_entries": user["diary_entries"]})
+        # One document per entry: a single atomic insert, independent of history size
+        result = await save_diary_entry(diary_entry)
         logger.info(f"Diary entry created for {username} on {date}")
-        return {"message": "Diary entry created successfully"}
+        return {
+            "message": "Diary entry created successfully",
+            "id": str(result.inserted_id),
+            "photos": photo_urls,
+            "failed_uploads": failed_uploads,
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Failed to create diary entry for {username}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to create diary entry: {str(e)}")
 
 @diary_router.get("/diary/entries/{username}")
-async def get_diary_entries(username: str):
+async def get_diary_entries(
+    username: str,
+    start_date: Optional[str] = Query(None, description="Earliest entry date (inclusive), e.g. 2025-05-01"),
+    end_date: Optional[str] = Query(None, description="Latest entry date (inclusive), e.g. 2025-05-31"),
+    limit: int = Query(DIARY_PAGE_DEFAULT_LIMIT, ge=1, le=DIARY_PAGE_MAX_LIMIT),
+    after_id: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    claims: Optional[dict] = Depends(optional_token_claims),
+):
     try:
-        user = get_user_by_username(username)
-        if not user:
-            logger.warning(f"User not found: {username}")
-            raise HTTPException(status_code=404, detail="User not found")
+        if after_id is not None and not ObjectId.is_valid(after_id):
+            raise HTTPException(status_code=400, detail="Invalid after_id")
+
+        # A valid bearer token for this user stands in for the database existence check
+        await ensure_user_exists(username, claims)
 
-        diary_entries = user.get("diary_entries", [])
+        entries = await get_user_diary_entries(
+            username,
+            start_date=start_date,
+            end_date=end_date,
+            limit=limit,
+            after_id=ObjectId(after_id) if after_id else None,
+        )
+        diary_entries = [serialize_diary_entry(entry) for entry in entries]
+        next_cursor = diary_entries[-1]["id"] if len(diary_entries) == limit else None
         logger.info(f"Fetched diary entries for {username}")
-        return {"diary_entries": diary_entries}
+        return {"diary_entries": diary_entries, "next_cursor": next_cursor}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Failed to fetch diary entries for {username}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch diary entries: {str(e)}")
\ No newline at end of file
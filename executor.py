@@ -0,0 +1,80 @@
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+import asyncio
+import functools
+import threading
+import logging
+import os
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Blocking work (TF/sklearn inference, pymongo, Cloudinary, SMTP) runs on this pool so the
+# event loop stays responsive. Once EXECUTOR_MAX_WORKERS calls are running and
+# EXECUTOR_MAX_QUEUE more are waiting, new calls are rejected with 429.
+EXECUTOR_MAX_WORKERS = int(os.getenv("EXECUTOR_MAX_WORKERS", str(min(32, (os.cpu_count() or 1) + 4))))
+EXECUTOR_MAX_QUEUE = int(os.getenv("EXECUTOR_MAX_QUEUE", "64"))
+EXECUTOR_RETRY_AFTER_SECONDS = os.getenv("EXECUTOR_RETRY_AFTER_SECONDS", "1")
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = 0
+_pending_lock = threading.Lock()
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=EXECUTOR_MAX_WORKERS, thread_name_prefix="blocking")
+                logger.info(f"Started blocking executor with {EXECUTOR_MAX_WORKERS} workers, queue limit {EXECUTOR_MAX_QUEUE}")
+    return _executor
+
+def _try_acquire_slot():
+    global _pending
+    with _pending_lock:
+        if _pending >= EXECUTOR_MAX_WORKERS + EXECUTOR_MAX_QUEUE:
+            return False
+        _pending += 1
+        return True
+
+def _release_slot():
+    global _pending
+    with _pending_lock:
+        _pending -= 1
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking callable on the shared pool, raising 429 when the pool is saturated."""
+    if not _try_acquire_slot():
+        logger.warning(f"Executor saturated, rejecting {getattr(func, '__name__', func)}")
+        raise HTTPException(
+            status_code=429,
+            detail="Server is busy, please retry shortly",
+            headers={"Retry-After": EXECUTOR_RETRY_AFTER_SECONDS},
+        )
+    try:
+        future = get_executor().submit(functools.partial(func, *args, **kwargs))
+    except BaseException:
+        _release_slot()
+        raise
+    # The slot is held until the thread is really done: a caller that stops waiting (timeout,
+    # cancellation) leaves the call running, and it must still count against the limit
+    future.add_done_callback(lambda _: _release_slot())
+    return await asyncio.wrap_future(future)
+
+def executor_stats():
+    with _pending_lock:
+        pending = _pending
+    return {
+        "max_workers": EXECUTOR_MAX_WORKERS,
+        "max_queue": EXECUTOR_MAX_QUEUE,
+        "pending": pending,
+    }
+
+def shutdown_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+            logger.info("Blocking executor shut down")
@@ -0,0 +1,146 @@
+"""Export the Keras skin type CNN to a lightweight CPU runtime and check parity.
+
+Usage:
+    python export_model.py --format tflite [--quantize none|dynamic|int8] [--images DIR]
+    python export_model.py --format onnx [--images DIR]
+
+The exported model is written to TFLITE_MODEL_PATH / ONNX_MODEL_PATH (see
+inference_backends.py) and served by setting INFERENCE_BACKEND accordingly.
+A parity report comparing the export against the original model (top-1
+agreement, score differences and latency per batch size) is written next to
+it as <model>.parity.json.
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import time
+import numpy as np
+from models import download_model, cnn_model_url, cnn_model_path, SKIN_TYPE_LABELS
+from image_preprocessing import preprocess_batch, allocate_batch
+from inference_backends import KerasBackend, load_inference_backend, TFLITE_MODEL_PATH, ONNX_MODEL_PATH
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png", "*.webp")
+
+def load_sample_batch(images_dir=None, count=64, seed=0):
+    """Real images from images_dir when given, otherwise a reproducible synthetic batch."""
+    if images_dir:
+        paths = sorted(path for pattern in IMAGE_PATTERNS for path in glob.glob(os.path.join(images_dir, pattern)))
+        if paths:
+            return preprocess_batch(paths[:count])
+        logger.warning(f"No images found in {images_dir}; falling back to synthetic inputs")
+    rng = np.random.default_rng(seed)
+    batch = allocate_batch(count)
+    batch[:] = rng.random(batch.shape, dtype=np.float32)
+    return batch
+
+def export_tflite(keras_model, output_path, quantize, sample_batch):
+    import tensorflow as tf
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    if quantize in ("dynamic", "int8"):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantize == "int8":
+        def representative_dataset():
+            for index in range(sample_batch.shape[0]):
+                yield [sample_batch[index:index + 1]]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+    with open(output_path, "wb") as f:
+        f.write(converter.convert())
+
+def export_onnx(keras_model, output_path):
+    import tensorflow as tf
+    import tf2onnx
+    input_shape = (None,) + tuple(keras_model.input_shape[1:])
+    spec = (tf.TensorSpec(input_shape, tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(keras_model, input_signature=spec, opset=13, output_path=output_path)
+
+def time_backend(backend, batch, repeats):
+    backend.predict(batch)  # warm-up
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        backend.predict(batch)
+        timings.append((time.perf_counter() - started) * 1000.0)
+    return {
+        "p50_ms": float(np.percentile(timings, 50)),
+        "p95_ms": float(np.percentile(timings, 95)),
+        "per_image_ms": float(np.percentile(timings, 50)) / batch.shape[0],
+    }
+
+def parity_report(reference, candidate, sample_batch, batch_sizes, repeats):
+    expected = reference.predict(sample_batch)
+    actual = candidate.predict(sample_batch)
+    report = {
+        "samples": int(sample_batch.shape[0]),
+        "labels": SKIN_TYPE_LABELS,
+        "top1_agreement": float(np.mean(np.argmax(expected, axis=1) == np.argmax(actual, axis=1))),
+        "max_abs_score_diff": float(np.max(np.abs(expected - actual))),
+        "mean_abs_score_diff": float(np.mean(np.abs(expected - actual))),
+        "latency": {},
+    }
+    for batch_size in batch_sizes:
+        batch = sample_batch[:batch_size]
+        if batch.shape[0] < batch_size:
+            batch = np.resize(sample_batch, (batch_size,) + sample_batch.shape[1:])
+        report["latency"][str(batch_size)] = {
+            reference.name: time_backend(reference, batch, repeats),
+            candidate.name: time_backend(candidate, batch, repeats),
+        }
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the skin type CNN to TFLite or ONNX")
+    parser.add_argument("--format", choices=["tflite", "onnx"], required=True)
+    parser.add_argument("--quantize", choices=["none", "dynamic", "int8"], default="none",
+                        help="TFLite only: dynamic-range or full int8 quantization")
+    parser.add_argument("--output", help="Output path (defaults to TFLITE_MODEL_PATH / ONNX_MODEL_PATH)")
+    parser.add_argument("--images", help="Directory of sample images for calibration and parity")
+    parser.add_argument("--samples", type=int, default=64)
+    parser.add_argument("--batch-sizes", default="1,8,32")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.format == "onnx" and args.quantize != "none":
+        parser.error("--quantize is only supported for --format tflite")
+
+    output_path = args.output or (TFLITE_MODEL_PATH if args.format == "tflite" else ONNX_MODEL_PATH)
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+
+    download_model(cnn_model_url, cnn_model_path)
+    reference = KerasBackend(cnn_model_path)
+    sample_batch = load_sample_batch(args.images, count=args.samples)
+
+    logger.info(f"Exporting {cnn_model_path} to {output_path} ({args.format}, quantize={args.quantize})")
+    if args.format == "tflite":
+        export_tflite(reference.model, output_path, args.quantize, sample_batch)
+    else:
+        export_onnx(reference.model, output_path)
+
+    candidate = load_inference_backend(args.format, output_path)
+    batch_sizes = [int(size) for size in args.batch_sizes.split(",") if size]
+    report = parity_report(reference, candidate, sample_batch, batch_sizes, args.repeats)
+    report.update({
+        "format": args.format,
+        "quantize": args.quantize,
+        "output": output_path,
+        "size_bytes": {
+            "keras": os.path.getsize(cnn_model_path),
+            args.format: os.path.getsize(output_path),
+        },
+    })
+
+    report_path = f"{output_path}.parity.json"
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Top-1 agreement {report['top1_agreement']:.2%}, "
+                f"max score diff {report['max_abs_score_diff']:.4f}; report written to {report_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+from PIL import Image
+import numpy as np
+import io
+import os
+
+# CNN input geometry
+CNN_INPUT_SIZE = (150, 150)
+CNN_INPUT_SHAPE = (CNN_INPUT_SIZE[1], CNN_INPUT_SIZE[0], 3)
+
+# Upload limits: bytes are enforced while streaming and pixels from the image header
+# (upload_ingest.py), and pixels again when decoding
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(40 * 1000 * 1000)))
+
+_SCALE = np.float32(1.0 / 255.0)
+
+class ImagePreprocessingError(ValueError):
+    pass
+
+class ImageTooLargeError(ImagePreprocessingError):
+    pass
+
+class InvalidImageError(ImagePreprocessingError):
+    pass
+
+def allocate_batch(batch_size):
+    return np.empty((batch_size,) + CNN_INPUT_SHAPE, dtype=np.float32)
+
+def decode_image_into(image_file, out):
+    """Decode an image (path, file object or bytes) into out, a float32 array of CNN_INPUT_SHAPE."""
+    if isinstance(image_file, (bytes, bytearray)):
+        image_file = io.BytesIO(image_file)
+    try:
+        image = Image.open(image_file)
+    except Exception as e:
+        raise InvalidImageError(f"Unsupported or corrupt image: {e}")
+
+    width, height = image.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageTooLargeError(f"Image is {width}x{height}, limit is {MAX_IMAGE_PIXELS} pixels")
+
+    try:
+        # For JPEGs this lets libjpeg decode at 1/2, 1/4 or 1/8 scale, still >= the target size
+        image.draft("RGB", CNN_INPUT_SIZE)
+        image = image.convert("RGB").resize(CNN_INPUT_SIZE)
+        np.multiply(np.asarray(image, dtype=np.uint8), _SCALE, out=out)
+    except ImagePreprocessingError:
+        raise
+    except Exception as e:
+        raise InvalidImageError(f"Unsupported or corrupt image: {e}")
+    return out
+
+def preprocess_image(image_file):
+    return decode_image_into(image_file, np.empty(CNN_INPUT_SHAPE, dtype=np.float32))
+
+def preprocess_batch(image_files, out=None):
+    """Decode several images straight into one (n, 150, 150, 3) float32 batch buffer."""
+    if out is None or out.shape[0] < len(image_files):
+        out = allocate_batch(len(image_files))
+    for index, image_file in enumerate(image_files):
+        decode_image_into(image_file, out[index])
+    return out[:len(image_files)]
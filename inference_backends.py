@@ -0,0 +1,153 @@
+from abc import ABC, abstractmethod
+import numpy as np
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# INFERENCE_BACKEND selects the runtime that serves the skin type CNN:
+#   keras  - the original .h5 model through TensorFlow (default)
+#   tflite - Model/cnn_skin_model.tflite, produced by export_model.py
+#   onnx   - Model/cnn_skin_model.onnx, produced by export_model.py
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "keras").lower()
+TFLITE_MODEL_PATH = os.getenv("TFLITE_MODEL_PATH", "Model/cnn_skin_model.tflite")
+ONNX_MODEL_PATH = os.getenv("ONNX_MODEL_PATH", "Model/cnn_skin_model.onnx")
+INFERENCE_NUM_THREADS = int(os.getenv("INFERENCE_NUM_THREADS", "0")) or None
+
+# TensorFlow thread pools; 0 lets TF choose. Lower these to pack more workers per host.
+TF_INTRA_OP_THREADS = int(os.getenv("TF_INTRA_OP_THREADS", str(INFERENCE_NUM_THREADS or 0)))
+TF_INTER_OP_THREADS = int(os.getenv("TF_INTER_OP_THREADS", "0"))
+
+# Batch sizes pushed through the model once at load time so no request pays for tracing/kernel setup
+SERVING_WARMUP_BATCH_SIZES = [
+    int(size) for size in os.getenv("SERVING_WARMUP_BATCH_SIZES", "1,2,4,8").split(",") if size.strip()
+]
+
+class InferenceBackend(ABC):
+    """Runs the CNN on a float32 (n, 150, 150, 3) batch and returns (n, num_classes) scores."""
+
+    name = "base"
+    input_shape = (150, 150, 3)
+
+    @abstractmethod
+    def predict(self, batch):
+        raise NotImplementedError
+
+    def warm_up(self, batch_sizes=SERVING_WARMUP_BATCH_SIZES):
+        for batch_size in batch_sizes:
+            self.predict(np.zeros((batch_size,) + tuple(self.input_shape), dtype=np.float32))
+        logger.info(f"{self.name} backend warmed up for batch sizes {list(batch_sizes)}")
+
+def configure_tf_threads(tf):
+    # Only possible before the TF runtime initializes, i.e. before the first model is loaded
+    try:
+        if TF_INTRA_OP_THREADS:
+            tf.config.threading.set_intra_op_parallelism_threads(TF_INTRA_OP_THREADS)
+        if TF_INTER_OP_THREADS:
+            tf.config.threading.set_inter_op_parallelism_threads(TF_INTER_OP_THREADS)
+    except RuntimeError as e:
+        logger.warning(f"Could not set TensorFlow thread counts: {e}")
+
+class KerasBackend(InferenceBackend):
+    """Serves the Keras model through a tf.function compiled once for a fixed input signature.
+
+    Unlike model.predict, calling the compiled function builds no data adapter per call and
+    never retraces, since the batch dimension is the only dynamic one.
+    """
+
+    name = "keras"
+
+    def __init__(self, model_path):
+        # TensorFlow is imported here so that importing models.py stays cheap
+        import tensorflow as tf
+        configure_tf_threads(tf)
+        self.model = tf.keras.models.load_model(model_path)
+        self.input_shape = tuple(int(dim) for dim in self.model.input_shape[1:])
+        self._serve = tf.function(
+            lambda images: self.model(images, training=False),
+            input_signature=[tf.TensorSpec((None,) + self.input_shape, tf.float32, name="images")],
+            reduce_retracing=True,
+        )
+
+    def predict(self, batch):
+        return self._serve(batch).numpy()
+
+class TFLiteBackend(InferenceBackend):
+    name = "tflite"
+
+    def __init__(self, model_path, num_threads=INFERENCE_NUM_THREADS):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        self.interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self._input["shape"][0])
+        # The interpreter is not thread-safe
+        self._lock = threading.Lock()
+
+    def _resize(self, batch_size):
+        if batch_size != self._batch_size:
+            shape = [batch_size] + list(self._input["shape"][1:])
+            self.interpreter.resize_tensor_input(self._input["index"], shape)
+            self.interpreter.allocate_tensors()
+            self._input = self.interpreter.get_input_details()[0]
+            self._output = self.interpreter.get_output_details()[0]
+            self._batch_size = batch_size
+
+    def predict(self, batch):
+        with self._lock:
+            self._resize(batch.shape[0])
+            inputs = batch
+            if self._input["dtype"] != np.float32:
+                # Fully int8-quantized model: quantize the inputs with the model's own parameters
+                scale, zero_point = self._input["quantization"]
+                info = np.iinfo(self._input["dtype"])
+                inputs = np.clip(np.round(batch / scale + zero_point), info.min, info.max)
+            self.interpreter.set_tensor(self._input["index"], inputs.astype(self._input["dtype"], copy=False))
+            self.interpreter.invoke()
+            outputs = self.interpreter.get_tensor(self._output["index"])
+            if self._output["dtype"] != np.float32:
+                scale, zero_point = self._output["quantization"]
+                outputs = (outputs.astype(np.float32) - zero_point) * scale
+            return outputs.copy()
+
+class ONNXBackend(InferenceBackend):
+    name = "onnx"
+
+    def __init__(self, model_path, num_threads=INFERENCE_NUM_THREADS):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self._input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch):
+        return self.session.run(None, {self._input_name: batch})[0]
+
+BACKENDS = {
+    "keras": KerasBackend,
+    "tflite": TFLiteBackend,
+    "onnx": ONNXBackend,
+}
+
+def default_model_path(backend_name, keras_model_path):
+    if backend_name == "tflite":
+        return TFLITE_MODEL_PATH
+    if backend_name == "onnx":
+        return ONNX_MODEL_PATH
+    return keras_model_path
+
+def load_inference_backend(backend_name, model_path):
+    if backend_name not in BACKENDS:
+        raise ValueError(f"Unknown INFERENCE_BACKEND: {backend_name} (expected one of {', '.join(BACKENDS)})")
+    if backend_name != "keras" and not os.path.exists(model_path):
+        raise FileNotFoundError(f"{model_path} not found; run export_model.py --format {backend_name} first")
+    backend = BACKENDS[backend_name](model_path)
+    logger.info(f"Loaded {backend_name} inference backend from {model_path}")
+    return backend
@@ -0,0 +1,259 @@
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+import multiprocessing
+import itertools
+import logging
+import os
+import threading
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# INFERENCE_WORKERS > 0 moves model inference into that many separate processes, each holding
+# its own copy of the models from models.py, so the HTTP process stays light. Preprocessed image
+# tensors are handed over through shared memory rather than pickled onto the queue.
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0"))
+INFERENCE_WORKER_HEALTH_INTERVAL_SECONDS = float(os.getenv("INFERENCE_WORKER_HEALTH_INTERVAL_SECONDS", "5"))
+INFERENCE_WORKER_HEALTH_TIMEOUT_SECONDS = float(os.getenv("INFERENCE_WORKER_HEALTH_TIMEOUT_SECONDS", "10"))
+
+def _worker_main(index, generation, request_queue, response_queue):
+    # Runs in the child process; requests are (request_id, kind, payload) tuples
+    import models
+
+    models.warm_up_models()
+    response_queue.put(("ready", index, generation, None))
+
+    def reply(request_id, future):
+        error = future.exception()
+        if error is not None:
+            response_queue.put(("error", index, request_id, str(error)))
+        else:
+            response_queue.put(("ok", index, request_id, np.asarray(future.result(), dtype=np.float32)))
+
+    while True:
+        message = request_queue.get()
+        if message is None:
+            break
+        request_id, kind, payload = message
+        try:
+            if kind == "ping":
+                response_queue.put(("ok", index, request_id, "pong"))
+            elif kind == "image":
+                shm_name, shape = payload
+                shm = shared_memory.SharedMemory(name=shm_name)
+                try:
+                    image_array = np.ndarray(shape, dtype=np.float32, buffer=shm.buf).copy()
+                finally:
+                    shm.close()
+                # The worker's own micro-batcher groups concurrent images into one forward pass
+                future = models.skin_type_batcher.submit(image_array)
+                future.add_done_callback(lambda done, request_id=request_id: reply(request_id, done))
+            elif kind == "text":
+                response_queue.put(("ok", index, request_id, models.predict_skin_issues_batch(payload)))
+            else:
+                response_queue.put(("error", index, request_id, f"Unknown request kind: {kind}"))
+        except Exception as e:
+            response_queue.put(("error", index, request_id, str(e)))
+
+class _WorkerHandle:
+    def __init__(self, index, generation, process, request_queue):
+        self.index = index
+        self.generation = generation
+        self.process = process
+        self.request_queue = request_queue
+        self.ready = False
+        self.started_at = time.monotonic()
+        self.last_healthy_at = None
+        self.restarts = 0
+
+class InferenceWorkerPool:
+    def __init__(self, num_workers=INFERENCE_WORKERS,
+                 health_interval=INFERENCE_WORKER_HEALTH_INTERVAL_SECONDS,
+                 health_timeout=INFERENCE_WORKER_HEALTH_TIMEOUT_SECONDS):
+        self.num_workers = max(1, int(num_workers))
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        # spawn, not fork: TensorFlow is not fork-safe
+        self._context = multiprocessing.get_context("spawn")
+        self._response_queue = self._context.Queue()
+        self._workers = [None] * self.num_workers
+        self._inflight = {}  # request_id -> (future, shared memory block or None, worker index)
+        self._request_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._listener = None
+        self._health_thread = None
+
+    def start(self):
+        for index in range(self.num_workers):
+            self._start_worker(index, generation=0)
+        self._listener = threading.Thread(target=self._listen, name="inference-pool-listener", daemon=True)
+        self._listener.start()
+        self._health_thread = threading.Thread(target=self._check_health, name="inference-pool-health", daemon=True)
+        self._health_thread.start()
+        logger.info(f"Started {self.num_workers} inference worker processes")
+
+    def _start_worker(self, index, generation, restarts=0):
+        request_queue = self._context.Queue()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(index, generation, request_queue, self._response_queue),
+            name=f"inference-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        handle = _WorkerHandle(index, generation, process, request_queue)
+        handle.restarts = restarts
+        self._workers[index] = handle
+
+    def _restart_worker(self, index, reason):
+        with self._lock:
+            old = self._workers[index]
+            logger.error(f"Restarting inference worker {index}: {reason}")
+            failed = [request_id for request_id, entry in self._inflight.items() if entry[2] == index]
+            for request_id in failed:
+                future, shm, _ = self._inflight.pop(request_id)
+                self._release(shm)
+                future.set_exception(RuntimeError(f"Inference worker {index} restarted: {reason}"))
+            self._start_worker(index, old.generation + 1, restarts=old.restarts + 1)
+        if old.process.is_alive():
+            old.process.terminate()
+        old.process.join(timeout=5)
+
+    def _pick_worker(self):
+        alive = [handle for handle in self._workers if handle is not None and handle.process.is_alive()]
+        if not alive:
+            raise RuntimeError("No inference workers available")
+        ready = [handle for handle in alive if handle.ready] or alive
+        load = {handle.index: 0 for handle in ready}
+        for _, _, index in self._inflight.values():
+            if index in load:
+                load[index] += 1
+        return min(ready, key=lambda handle: load[handle.index])
+
+    def _submit(self, kind, payload, shm=None, worker=None):
+        future = Future()
+        with self._lock:
+            try:
+                worker = worker or self._pick_worker()
+            except Exception:
+                self._release(shm)
+                raise
+            request_id = next(self._request_ids)
+            self._inflight[request_id] = (future, shm, worker.index)
+            worker.request_queue.put((request_id, kind, payload))
+        return future
+
+    def submit_image(self, image_array) -> Future:
+        """Send one preprocessed float32 image to a worker; resolves to its class scores."""
+        image_array = np.ascontiguousarray(image_array, dtype=np.float32)
+        shm = shared_memory.SharedMemory(create=True, size=image_array.nbytes)
+        np.ndarray(image_array.shape, dtype=np.float32, buffer=shm.buf)[:] = image_array
+        return self._submit("image", (shm.name, image_array.shape), shm=shm)
+
+    def submit_text(self, descriptions) -> Future:
+        """Predict skin issues for a list of descriptions in a worker; resolves to a list of lists."""
+        return self._submit("text", list(descriptions))
+
+    @staticmethod
+    def _release(shm):
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+    def _listen(self):
+        while not self._stopping.is_set():
+            message = self._response_queue.get()
+            if message is None:
+                break
+            status, index, key, value = message
+            with self._lock:
+                if status == "ready":
+                    handle = self._workers[index]
+                    if handle is not None and handle.generation == key:
+                        handle.ready = True
+                        handle.last_healthy_at = time.monotonic()
+                        logger.info(f"Inference worker {index} is ready")
+                    continue
+                entry = self._inflight.pop(key, None)
+            if entry is None:
+                # Response for a request already failed by a restart
+                continue
+            future, shm, _ = entry
+            self._release(shm)
+            if status == "ok":
+                future.set_result(value)
+            else:
+                future.set_exception(RuntimeError(value))
+
+    def _check_health(self):
+        while not self._stopping.wait(self.health_interval):
+            for index in range(self.num_workers):
+                handle = self._workers[index]
+                if self._stopping.is_set():
+                    return
+                if not handle.process.is_alive():
+                    self._restart_worker(index, f"process exited with code {handle.process.exitcode}")
+                    continue
+                if not handle.ready:
+                    continue
+                try:
+                    self._submit("ping", None, worker=handle).result(timeout=self.health_timeout)
+                    handle.last_healthy_at = time.monotonic()
+                except Exception as e:
+                    self._restart_worker(index, f"health check failed: {e or 'timed out'}")
+
+    def status(self):
+        with self._lock:
+            workers = {}
+            for handle in self._workers:
+                inflight = sum(1 for _, _, index in self._inflight.values() if index == handle.index)
+                workers[f"worker-{handle.index}"] = {
+                    "pid": handle.process.pid,
+                    "alive": handle.process.is_alive(),
+                    "ready": handle.ready,
+                    "restarts": handle.restarts,
+                    "inflight": inflight,
+                    "seconds_since_healthy": (time.monotonic() - handle.last_healthy_at) if handle.last_healthy_at else None,
+                }
+        return {
+            "ready": any(worker["ready"] and worker["alive"] for worker in workers.values()),
+            "workers": workers,
+        }
+
+    def stop(self):
+        self._stopping.set()
+        for handle in self._workers:
+            if handle is not None and handle.process.is_alive():
+                handle.request_queue.put(None)
+        for handle in self._workers:
+            if handle is not None:
+                handle.process.join(timeout=5)
+                if handle.process.is_alive():
+                    handle.process.terminate()
+        self._response_queue.put(None)
+        with self._lock:
+            for future, shm, _ in self._inflight.values():
+                self._release(shm)
+                future.set_exception(RuntimeError("Inference worker pool stopped"))
+            self._inflight.clear()
+        logger.info("Inference worker pool stopped")
+
+_pool = None
+
+def get_inference_pool():
+    return _pool
+
+def start_inference_workers(num_workers=INFERENCE_WORKERS):
+    global _pool
+    if _pool is None and num_workers > 0:
+        _pool = InferenceWorkerPool(num_workers)
+        _pool.start()
+    return _pool
+
+def stop_inference_workers():
+    global _pool
+    if _pool is not None:
+        _pool.stop()
+        _pool = None
@@ -0,0 +1,232 @@
+from abc import ABC, abstractmethod
+from fastapi import HTTPException
+from cache import TTLCache
+from metrics import callback_gauge, counter, histogram
+import asyncio
+import logging
+import os
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Background jobs for the /skin/jobs/* routes. A job is queued and answered with its id at
+# once; JOB_WORKERS tasks on the event loop run queued jobs and keep finished jobs for
+# JOB_RESULT_TTL_SECONDS so clients can poll them. Once JOB_QUEUE_MAX jobs are waiting, new
+# submissions get 429. JOB_QUEUE_BACKEND picks the queue implementation; "memory" (in this
+# process, lost on restart) is the only one so far, and others plug in via set_job_queue().
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "memory").lower()
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "1000"))
+JOB_RESULT_TTL_SECONDS = float(os.getenv("JOB_RESULT_TTL_SECONDS", "3600"))
+JOB_MAX_STORED = int(os.getenv("JOB_MAX_STORED", "100000"))
+JOB_RETRY_AFTER_SECONDS = os.getenv("JOB_RETRY_AFTER_SECONDS", "5")
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+JOBS_FINISHED = counter("skiniq_jobs_finished_total", "Jobs finished, by kind and final status", ("kind", "status"))
+JOB_WAIT = histogram("skiniq_job_wait_seconds", "Time jobs spent queued before a worker picked them up", ("kind",))
+JOB_RUN = histogram("skiniq_job_run_seconds", "Time jobs spent running", ("kind",))
+
+class Job:
+    def __init__(self, kind, username, payload):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.username = username
+        self.payload = payload
+        self.status = JOB_QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.error_status_code = None
+
+    def to_dict(self, include_result=True):
+        data = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.status == JOB_FAILED:
+            data["error"] = self.error
+            data["error_status_code"] = self.error_status_code
+        elif include_result and self.status == JOB_SUCCEEDED:
+            data["result"] = self.result
+        return data
+
+class JobQueue(ABC):
+    """Interface the job routes use; implementations decide where jobs wait and run."""
+
+    name = "base"
+
+    @abstractmethod
+    async def start(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def stop(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def submit(self, kind, username, payload):
+        """Queue a job and return it; raises HTTPException(429) when the queue is full."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get(self, job_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def stats(self):
+        raise NotImplementedError
+
+_handlers = {}
+_discarders = {}
+
+def register_job_handler(kind, handler, discard=None):
+    """handler(payload) is awaited by a worker; its return value becomes the job result.
+
+    discard(payload), if given, releases the payload of a job that is dropped without running.
+    """
+    _handlers[kind] = handler
+    if discard is not None:
+        _discarders[kind] = discard
+
+class InProcessJobQueue(JobQueue):
+    name = "memory"
+
+    def __init__(self, workers=JOB_WORKERS, max_queue=JOB_QUEUE_MAX,
+                 result_ttl_seconds=JOB_RESULT_TTL_SECONDS, max_stored=JOB_MAX_STORED):
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self._queue = None
+        self._tasks = []
+        self._jobs = TTLCache(max_size=max_stored, ttl_seconds=result_ttl_seconds)
+        self._queued = {}  # job id -> job, in submission order, for the depth/age gauges
+        self._running = 0
+
+    @property
+    def running(self):
+        return bool(self._tasks)
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._tasks = [asyncio.create_task(self._worker(index)) for index in range(self.workers)]
+        logger.info(f"Started in-process job queue with {self.workers} workers, queue limit {self.max_queue}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._queued:
+            logger.error(f"Job queue stopped with {len(self._queued)} queued jobs; they are lost")
+        for job in self._queued.values():
+            discard = _discarders.get(job.kind)
+            if discard is not None:
+                try:
+                    discard(job.payload)
+                except Exception as e:
+                    logger.warning(f"Discarding {job.kind} job {job.id} failed: {e}")
+            self._fail(job, 503, "Server shut down before the job ran")
+        self._queued.clear()
+        logger.info("Job queue stopped")
+
+    def submit(self, kind, username, payload):
+        if kind not in _handlers:
+            raise ValueError(f"No handler registered for job kind {kind}")
+        if not self._tasks:
+            raise HTTPException(status_code=503, detail="Job queue is not running")
+        job = Job(kind, username, payload)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            logger.warning(f"Job queue full, rejecting {kind} job for {username}")
+            raise HTTPException(
+                status_code=429,
+                detail="Too many queued jobs, please retry shortly",
+                headers={"Retry-After": JOB_RETRY_AFTER_SECONDS},
+            )
+        self._queued[job.id] = job
+        self._jobs.set(job.id, job)
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def _fail(self, job, status_code, error):
+        job.status = JOB_FAILED
+        job.error = error
+        job.error_status_code = status_code
+        job.finished_at = time.time()
+        job.payload = None
+        JOBS_FINISHED.inc(job.kind, JOB_FAILED)
+
+    async def _worker(self, index):
+        while True:
+            job = await self._queue.get()
+            self._queued.pop(job.id, None)
+            self._running += 1
+            job.status = JOB_RUNNING
+            job.started_at = time.time()
+            JOB_WAIT.observe(job.kind, value=job.started_at - job.created_at)
+            try:
+                job.result = await _handlers[job.kind](job.payload)
+                job.status = JOB_SUCCEEDED
+                job.finished_at = time.time()
+                job.payload = None
+                JOBS_FINISHED.inc(job.kind, JOB_SUCCEEDED)
+            except asyncio.CancelledError:
+                self._fail(job, 503, "Server shut down while the job was running")
+                raise
+            except HTTPException as e:
+                self._fail(job, e.status_code, e.detail)
+            except Exception as e:
+                logger.error(f"{job.kind} job {job.id} failed: {e}")
+                self._fail(job, 500, str(e))
+            finally:
+                self._running -= 1
+                JOB_RUN.observe(job.kind, value=time.time() - job.started_at)
+                self._queue.task_done()
+
+    def oldest_queued_age(self):
+        oldest = next(iter(self._queued.values()), None)
+        return time.time() - oldest.created_at if oldest else 0.0
+
+    def stats(self):
+        return {
+            "backend": self.name,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "queued": len(self._queued),
+            "running": self._running,
+            "oldest_queued_age_seconds": self.oldest_queued_age(),
+        }
+
+_job_queue = None
+
+def get_job_queue():
+    global _job_queue
+    if _job_queue is None:
+        if JOB_QUEUE_BACKEND != "memory":
+            logger.warning(f"Unknown JOB_QUEUE_BACKEND {JOB_QUEUE_BACKEND!r}; using the in-process queue")
+        _job_queue = InProcessJobQueue()
+    return _job_queue
+
+def set_job_queue(queue):
+    global _job_queue
+    _job_queue = queue
+
+callback_gauge("skiniq_job_queue_depth", "Jobs waiting for a worker", lambda: get_job_queue().stats()["queued"])
+callback_gauge("skiniq_jobs_running", "Jobs currently running", lambda: get_job_queue().stats()["running"])
+callback_gauge("skiniq_job_oldest_queued_age_seconds", "Age of the oldest queued job",
+               lambda: get_job_queue().stats()["oldest_queued_age_seconds"])
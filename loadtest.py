@@ -0,0 +1,193 @@
+"""Replay user journeys against the full app running on local stand-ins.
+
+Usage:
+    python loadtest.py [--journeys 50] [--rate 5] [--max-in-flight 100] [--output report.json]
+
+Boots server.py in-process with LOCAL_STANDINS=1 (in-memory MongoDB, local file storage,
+local SMTP sink; see local_standins.py), runs its startup hooks, and starts --journeys
+journeys at --rate per second:
+
+    signup -> verify-otp (OTP read from the SMTP sink) -> login -> questionnaire
+    -> analyze -> diary entry -> diary list -> profile
+
+Requests go through an in-process httpx ASGI client with the login's bearer token.
+Reports throughput and latency percentiles per endpoint, plus completed/failed journeys.
+Model inference is real, so the model files must be available as for a normal run.
+"""
+import argparse
+import asyncio
+import email
+import json
+import logging
+import os
+import random
+import re
+import time
+from collections import defaultdict
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger("loadtest")
+
+OTP_RE = re.compile(r">\s*(\d{6})\s*<")
+
+class JourneyFailed(Exception):
+    pass
+
+class LoadTest:
+    def __init__(self, client, smtp_server, images, descriptions, otp_timeout=10.0):
+        self.client = client
+        self.smtp_server = smtp_server
+        self.images = images
+        self.descriptions = descriptions
+        self.otp_timeout = otp_timeout
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.completed = 0
+        self.failed = 0
+
+    async def request(self, endpoint, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except Exception as e:
+            self.errors[endpoint] += 1
+            raise JourneyFailed(f"{endpoint}: {e}")
+        elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            self.errors[endpoint] += 1
+            raise JourneyFailed(f"{endpoint}: {response.status_code} {response.text[:200]}")
+        self.latencies[endpoint].append(elapsed)
+        return response.json()
+
+    async def wait_for_otp(self, address):
+        from your_email_module import email_queue
+        deadline = time.monotonic() + self.otp_timeout
+        while time.monotonic() < deadline:
+            for receiver, subject, error in list(email_queue.recent_failures):
+                if receiver == address:
+                    raise JourneyFailed(f"OTP email to {address} could not be sent: {error}")
+            for message in reversed(list(self.smtp_server.messages)):
+                if address not in message["to"]:
+                    continue
+                parsed = email.message_from_bytes(message["data"])
+                for part in parsed.walk():
+                    payload = part.get_payload(decode=True)
+                    match = OTP_RE.search(payload.decode("utf-8", errors="replace")) if payload else None
+                    if match:
+                        return match.group(1)
+            await asyncio.sleep(0.05)
+        raise JourneyFailed(f"No OTP email for {address} within {self.otp_timeout}s")
+
+    async def journey(self, index, rng):
+        username = f"load_{index}_{rng.randrange(1 << 30)}"
+        address = f"{username}@example.com"
+        password = "load-test-password"
+        try:
+            await self.request("POST /auth/signup", "POST", "/auth/signup", json={
+                "username": username, "email": address, "password": password, "terms_accepted": True,
+            })
+            otp = await self.wait_for_otp(address)
+            await self.request("POST /auth/verify-otp", "POST", "/auth/verify-otp", json={"email": address, "otp": otp})
+            login = await self.request("POST /auth/login", "POST", "/auth/login", json={"email": address, "password": password})
+            headers = {"Authorization": f"Bearer {login['access_token']}"}
+
+            await self.request("POST /skin/questionnaire", "POST", "/skin/questionnaire", headers=headers, json={
+                "username": username,
+                "gender": rng.choice(["female", "male"]),
+                "age": rng.randint(18, 65),
+                "skinType": rng.choice(["dry", "oily", "normal", "combination", "sensitive"]),
+                "skinConcerns": [],
+                "skinConditionDiseases": [],
+                "skinBreakouts": "sometimes",
+                "skinDescription": rng.choice(self.descriptions),
+            })
+            await self.request("POST /skin/analyze", "POST", "/skin/analyze", headers=headers,
+                               params={"username": username},
+                               files={"file": ("selfie.jpg", rng.choice(self.images), "image/jpeg")})
+            await self.request("POST /diary/diary_entry", "POST", "/diary/diary_entry", headers=headers,
+                               data={"username": username, "date": time.strftime("%Y-%m-%d"), "text": "Load test entry"},
+                               files=[("file", ("photo.jpg", rng.choice(self.images), "image/jpeg"))])
+            await self.request("GET /diary/diary/entries/{username}", "GET", f"/diary/diary/entries/{username}", headers=headers)
+            await self.request("GET /auth/profile/{username}", "GET", f"/auth/profile/{username}", headers=headers)
+            self.completed += 1
+        except JourneyFailed as e:
+            self.failed += 1
+            logger.warning(f"Journey {index} failed: {e}")
+
+    def report(self, elapsed):
+        from bench_inference import summarize
+        endpoints = {}
+        for endpoint in sorted(set(self.latencies) | set(self.errors)):
+            stats = summarize(self.latencies[endpoint], elapsed, self.errors[endpoint])
+            stats.pop("peak_rss_mb")
+            endpoints[endpoint] = stats
+        return {
+            "seconds": elapsed,
+            "journeys_completed": self.completed,
+            "journeys_failed": self.failed,
+            "journeys_per_second": self.completed / elapsed if elapsed else 0.0,
+            "endpoints": endpoints,
+        }
+
+async def run(args):
+    import httpx
+    from bench_inference import load_descriptions, make_images, peak_rss_mb
+    from server import app
+    from local_standins import get_local_smtp_server
+
+    rng = random.Random(args.seed)
+    images = make_images(args.images, args.seed)
+    descriptions = load_descriptions()
+
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=args.timeout) as client:
+            load_test = LoadTest(client, get_local_smtp_server(), images, descriptions)
+            in_flight = asyncio.Semaphore(args.max_in_flight)
+
+            async def limited(index, journey_rng):
+                async with in_flight:
+                    await load_test.journey(index, journey_rng)
+
+            started = time.perf_counter()
+            tasks = []
+            for index in range(args.journeys):
+                # Open-loop arrivals: start journeys on schedule even if earlier ones are slow
+                delay = started + index / args.rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(limited(index, random.Random(rng.random()))))
+            await asyncio.gather(*tasks)
+            report = load_test.report(time.perf_counter() - started)
+    finally:
+        await app.router.shutdown()
+    report["config"] = {"journeys": args.journeys, "rate": args.rate, "max_in_flight": args.max_in_flight, "seed": args.seed}
+    report["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the app end to end against local stand-ins.")
+    parser.add_argument("--journeys", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=5.0, help="Journeys started per second")
+    parser.add_argument("--max-in-flight", type=int, default=100, help="Cap on concurrently running journeys")
+    parser.add_argument("--images", type=int, default=20, help="Distinct synthetic images to upload")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report here (default: stdout)")
+    args = parser.parse_args()
+
+    os.environ["LOCAL_STANDINS"] = "1"
+    os.environ["STORAGE_BACKEND"] = "local"
+    os.environ.setdefault("JWT_SECRET_KEY", "local-load-test-secret")
+
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote load test report to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
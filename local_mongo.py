@@ -0,0 +1,218 @@
+"""In-memory stand-in for the MongoDB collections used by mongo_async.py.
+
+Supports the subset of the Motor API the app uses (find_one, find with sort/limit,
+insert_one/insert_many, update_one with $set, create_indexes) and the query operators in
+our filters ($in, $lt/$lte/$gt/$gte, $or). install_in_memory_mongo() points mongo_async at it,
+so routes run unchanged without a MongoDB server; benchmarks and load tests use it.
+"""
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+import copy
+import threading
+
+def _get_field(doc, field):
+    value = doc
+    for part in field.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+def _compare(value, operator, operand):
+    if operator == "$in":
+        return value in operand
+    if operator == "$nin":
+        return value not in operand
+    if operator == "$ne":
+        return value != operand
+    if operator == "$exists":
+        return (value is not None) == bool(operand)
+    if value is None:
+        return False
+    if operator == "$lt":
+        return value < operand
+    if operator == "$lte":
+        return value <= operand
+    if operator == "$gt":
+        return value > operand
+    if operator == "$gte":
+        return value >= operand
+    raise NotImplementedError(f"Unsupported query operator: {operator}")
+
+def matches(doc, query):
+    for field, condition in query.items():
+        if field == "$or":
+            if not any(matches(doc, clause) for clause in condition):
+                return False
+            continue
+        if field == "$and":
+            if not all(matches(doc, clause) for clause in condition):
+                return False
+            continue
+        value = _get_field(doc, field)
+        if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+            if not all(_compare(value, operator, operand) for operator, operand in condition.items()):
+                return False
+        elif value != condition:
+            return False
+    return True
+
+def project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    include_id = projection.get("_id", 1)
+    fields = {field: value for field, value in projection.items() if field != "_id"}
+    if fields and all(fields.values()):
+        result = {field: copy.deepcopy(doc[field]) for field in fields if field in doc}
+    else:
+        result = {field: copy.deepcopy(value) for field, value in doc.items() if field not in fields}
+    if include_id and "_id" in doc:
+        result["_id"] = doc["_id"]
+    else:
+        result.pop("_id", None)
+    return result
+
+class _InsertOneResult:
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+
+class _InsertManyResult:
+    def __init__(self, inserted_ids):
+        self.inserted_ids = inserted_ids
+
+class _UpdateResult:
+    def __init__(self, matched_count, modified_count):
+        self.matched_count = matched_count
+        self.modified_count = modified_count
+
+class InMemoryCursor:
+    def __init__(self, docs, projection=None):
+        self._docs = docs
+        self._projection = projection
+        self._limit = 0
+
+    def sort(self, key_or_list, direction=None):
+        keys = [(key_or_list, direction or 1)] if isinstance(key_or_list, str) else list(key_or_list)
+        for field, order in reversed(keys):
+            self._docs.sort(key=lambda doc: (_get_field(doc, field) is not None, _get_field(doc, field)), reverse=order < 0)
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def _results(self):
+        docs = self._docs[:self._limit] if self._limit else self._docs
+        return [project(doc, self._projection) for doc in docs]
+
+    async def to_list(self, length=None):
+        results = self._results()
+        return results[:length] if length else results
+
+    def __aiter__(self):
+        async def iterate():
+            for doc in self._results():
+                yield doc
+        return iterate()
+
+    def __iter__(self):
+        return iter(self._results())
+
+class InMemoryCollection:
+    def __init__(self, name):
+        self.name = name
+        self._docs = []
+        self._unique_fields = []
+        self._lock = threading.Lock()
+
+    async def create_indexes(self, indexes):
+        for index in indexes:
+            document = index.document
+            if document.get("unique"):
+                self._unique_fields.append(tuple(document["key"].keys()))
+        return [index.document["name"] for index in indexes]
+
+    def _check_unique(self, doc):
+        for other in self._docs:
+            if other["_id"] == doc["_id"]:
+                raise DuplicateKeyError(f"Duplicate _id {doc['_id']} in {self.name}")
+            for fields in self._unique_fields:
+                if all(_get_field(other, field) == _get_field(doc, field) for field in fields):
+                    raise DuplicateKeyError(f"Duplicate {fields} in {self.name}")
+
+    async def insert_one(self, doc):
+        doc.setdefault("_id", ObjectId())
+        with self._lock:
+            self._check_unique(doc)
+            self._docs.append(copy.deepcopy(doc))
+        return _InsertOneResult(doc["_id"])
+
+    async def insert_many(self, docs, ordered=True):
+        inserted, errors = [], []
+        for index, doc in enumerate(docs):
+            try:
+                inserted.append((await self.insert_one(doc)).inserted_id)
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(inserted)})
+        return _InsertManyResult(inserted)
+
+    async def find_one(self, query, projection=None):
+        with self._lock:
+            for doc in self._docs:
+                if matches(doc, query):
+                    return project(doc, projection)
+        return None
+
+    def find(self, query=None, projection=None):
+        with self._lock:
+            docs = [doc for doc in self._docs if matches(doc, query or {})]
+        return InMemoryCursor(docs, projection)
+
+    async def update_one(self, query, update):
+        with self._lock:
+            for doc in self._docs:
+                if matches(doc, query):
+                    doc.update(copy.deepcopy(update.get("$set", {})))
+                    return _UpdateResult(1, 1)
+        return _UpdateResult(0, 0)
+
+    async def count_documents(self, query):
+        with self._lock:
+            return sum(1 for doc in self._docs if matches(doc, query))
+
+class InMemoryDatabase:
+    def __init__(self):
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = InMemoryCollection(name)
+        return self._collections[name]
+
+    async def command(self, name):
+        return {"ok": 1.0}
+
+class InMemoryClient:
+    def __init__(self):
+        self.db = InMemoryDatabase()
+
+    def __getitem__(self, name):
+        return self.db
+
+    def close(self):
+        pass
+
+def install_in_memory_mongo():
+    """Point mongo_async at a fresh in-memory database and return that database."""
+    import mongo_async
+    client = InMemoryClient()
+    mongo_async.client = client
+    mongo_async.db = client.db
+    mongo_async.users_collection = client.db["users"]
+    mongo_async.diary_collection = client.db["diary_entries"]
+    mongo_async.skin_analysis_collection = client.db["skin_analysis"]
+    return client.db
@@ -0,0 +1,113 @@
+"""Minimal in-memory SMTP server for local runs and load tests.
+
+Accepts any credentials and keeps received messages in memory instead of delivering them.
+Point the app at it with EMAIL_SMTP_HOST=127.0.0.1 EMAIL_SMTP_PORT=<port> EMAIL_USE_TLS=0.
+
+    python local_smtp.py --port 1025
+"""
+import argparse
+import logging
+import socketserver
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line):
+        self.wfile.write((line + "\r\n").encode("utf-8"))
+
+    def handle(self):
+        sink = self.server.sink
+        sender, recipients = None, []
+        self._reply("220 localhost SKINIQ local SMTP ready")
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            line = raw.decode("utf-8", errors="replace").rstrip("\r\n")
+            command = line[:4].upper()
+            if command in ("EHLO", "HELO"):
+                if command == "EHLO":
+                    self._reply("250-localhost")
+                    self._reply("250 AUTH PLAIN LOGIN")
+                else:
+                    self._reply("250 localhost")
+            elif command == "AUTH":
+                self._reply("235 Authentication successful")
+            elif command == "MAIL":
+                sender, recipients = line.split(":", 1)[1].strip().strip("<>"), []
+                self._reply("250 OK")
+            elif command == "RCPT":
+                recipients.append(line.split(":", 1)[1].strip().strip("<>"))
+                self._reply("250 OK")
+            elif command == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line in (b".\r\n", b".\n"):
+                        break
+                    lines.append(data_line[1:] if data_line.startswith(b"..") else data_line)
+                sink.record(sender, recipients, b"".join(lines))
+                sender, recipients = None, []
+                self._reply("250 OK: queued")
+            elif command == "RSET":
+                sender, recipients = None, []
+                self._reply("250 OK")
+            elif command == "NOOP":
+                self._reply("250 OK")
+            elif command == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Command not implemented")
+
+class _ThreadingSMTPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class LocalSMTPServer:
+    """Threaded SMTP sink; received messages are available on .messages."""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self._server = _ThreadingSMTPServer((host, port), _SMTPHandler)
+        self._server.sink = self
+        self._thread = None
+        self._lock = threading.Lock()
+        self.messages = []
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def record(self, sender, recipients, data):
+        with self._lock:
+            self.messages.append({"from": sender, "to": recipients, "data": data, "received_at": time.time()})
+        logger.info(f"Local SMTP received message from {sender} to {', '.join(recipients)}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="local-smtp", daemon=True)
+        self._thread.start()
+        logger.info(f"Local SMTP server listening on {self.address[0]}:{self.address[1]}")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local SMTP sink that accepts and discards mail.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1025)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    server = LocalSMTPServer(args.host, args.port).start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
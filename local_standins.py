@@ -0,0 +1,45 @@
+"""Run the app without its external services, for load tests and offline development.
+
+With LOCAL_STANDINS=1 the server's startup hook calls start_local_standins(), which
+  * points mongo_async at the in-memory store from local_mongo.py,
+  * stores uploads on the local filesystem (LocalFileStorage, see storage.py),
+  * starts the in-process SMTP sink from local_smtp.py and sends all email there.
+Nothing leaves the machine; data is lost when the process exits.
+"""
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+LOCAL_STANDINS = os.getenv("LOCAL_STANDINS", "0") == "1"
+LOCAL_SMTP_PORT = int(os.getenv("LOCAL_SMTP_PORT", "0"))  # 0 picks a free port
+LOCAL_SENDER_ADDRESS = "skiniq@localhost"
+
+_smtp_server = None
+
+def start_local_standins(smtp_port=LOCAL_SMTP_PORT):
+    global _smtp_server
+    from local_mongo import install_in_memory_mongo
+    from local_smtp import LocalSMTPServer
+    from storage import LocalFileStorage, set_storage_backend
+    import your_email_module
+
+    install_in_memory_mongo()
+    set_storage_backend(LocalFileStorage())
+    # Offline runs have no .env, and without a sender every send would fail
+    os.environ.setdefault("EMAIL_HOST_USER", LOCAL_SENDER_ADDRESS)
+    if _smtp_server is None:
+        _smtp_server = LocalSMTPServer(port=smtp_port).start()
+        host, port = _smtp_server.address
+        your_email_module.email_queue.pool = your_email_module.SMTPConnectionPool(host=host, port=port, use_tls=False)
+    logger.warning("Running against local stand-ins: in-memory MongoDB, local file storage, local SMTP sink")
+    return _smtp_server
+
+def get_local_smtp_server():
+    return _smtp_server
+
+def stop_local_standins():
+    global _smtp_server
+    if _smtp_server is not None:
+        _smtp_server.stop()
+        _smtp_server = None
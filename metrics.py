@@ -0,0 +1,250 @@
+from contextlib import contextmanager
+import bisect
+import functools
+import inspect
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Minimal in-process Prometheus metrics (text exposition format 0.0.4), so recording a
+# sample costs a lock and a few additions and there is no extra dependency.
+# span()/timed() record per-stage latency histograms, in-flight gauges and error counts;
+# MetricsMiddleware does the same per HTTP route. Everything is rendered at /metrics.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return self._header() + [f"{self.name}{_format_labels(self.label_names, labels)} {value}" for labels, value in items]
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, *labels, amount=1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels, amount=1.0):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value):
+        with self._lock:
+            self._values[labels] = float(value)
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return self._header() + [f"{self.name}{_format_labels(self.label_names, labels)} {value}" for labels, value in items]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, *labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                # per-bucket (non-cumulative) counts, then sum and count
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        with self._lock:
+            items = [(labels, (list(entry[0]), entry[1], entry[2])) for labels, entry in self._values.items()]
+        lines = self._header()
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(self.label_names, labels, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            bucket_labels = _format_labels(self.label_names, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {count}")
+        return lines
+
+class CallbackGauge(_Metric):
+    """Gauge whose labelled values are read from callback() at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, callback, label_names=()):
+        super().__init__(name, help_text, label_names)
+        self.callback = callback
+
+    def render(self):
+        try:
+            values = self.callback()
+        except Exception as e:
+            logger.warning(f"Metrics callback for {self.name} failed: {e}")
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return self._header() + [
+            f"{self.name}{_format_labels(self.label_names, labels if isinstance(labels, tuple) else (labels,))} {float(value)}"
+            for labels, value in values.items()
+        ]
+
+_registry = []
+_registry_lock = threading.Lock()
+
+def _register(metric):
+    with _registry_lock:
+        _registry.append(metric)
+    return metric
+
+def counter(name, help_text, label_names=()):
+    return _register(Counter(name, help_text, label_names))
+
+def gauge(name, help_text, label_names=()):
+    return _register(Gauge(name, help_text, label_names))
+
+def histogram(name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram(name, help_text, label_names, buckets))
+
+def callback_gauge(name, help_text, callback, label_names=()):
+    return _register(CallbackGauge(name, help_text, callback, label_names))
+
+def render_metrics():
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# --- Stage spans ---
+
+STAGE_DURATION = histogram("skiniq_stage_duration_seconds", "Time spent in an internal stage", ("stage",))
+STAGE_INFLIGHT = gauge("skiniq_stage_inflight", "Calls currently inside a stage", ("stage",))
+STAGE_ERRORS = counter("skiniq_stage_errors_total", "Stage calls that raised", ("stage",))
+
+@contextmanager
+def span(stage):
+    """Time a block as `stage`, tracking in-flight calls and exceptions."""
+    STAGE_INFLIGHT.inc(stage)
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage)
+        raise
+    finally:
+        STAGE_DURATION.observe(stage, value=time.perf_counter() - started)
+        STAGE_INFLIGHT.dec(stage)
+
+def timed(stage):
+    """Decorator form of span() for sync and async functions."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# --- HTTP ---
+
+HTTP_DURATION = histogram("skiniq_http_request_duration_seconds", "HTTP request latency", ("method", "route", "status"))
+HTTP_INFLIGHT = gauge("skiniq_http_requests_inflight", "HTTP requests currently being served", ("method", "route"))
+HTTP_ERRORS = counter("skiniq_http_request_errors_total", "HTTP requests answered with 5xx or an unhandled exception", ("method", "route"))
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, in-flight count and errors per route template."""
+
+    KNOWN_METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+
+    def __init__(self, app, skip_paths=("/metrics",)):
+        self.app = app
+        self.skip_paths = set(skip_paths)
+        self._route_prefixes = None
+
+    def _prefix_label(self, scope):
+        """Top-level path prefix of a registered route (/auth, /skin, ...), else "other"."""
+        if self._route_prefixes is None:
+            routes = getattr(scope.get("app"), "routes", None)
+            if routes is None:
+                return "other"
+            # Built once from the app's routes: client-supplied paths can't add label values
+            self._route_prefixes = {
+                "/" + route.path.lstrip("/").split("/", 1)[0]
+                for route in routes
+                if getattr(route, "path", None) and not route.path.lstrip("/").startswith("{")
+            }
+        prefix = "/" + scope["path"].lstrip("/").split("/", 1)[0]
+        return prefix if prefix in self._route_prefixes else "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"] if scope["method"] in self.KNOWN_METHODS else "OTHER"
+        # The route template is only known after routing, so in-flight requests are counted per
+        # top-level prefix of the app's routes, keeping label cardinality bounded
+        inflight_route = self._prefix_label(scope)
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_INFLIGHT.inc(method, inflight_route)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_INFLIGHT.dec(method, inflight_route)
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            HTTP_DURATION.observe(method, route_path, str(status_code), value=time.perf_counter() - started)
+            if status_code >= 500:
+                HTTP_ERRORS.inc(method, route_path)
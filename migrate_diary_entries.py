@@ -0,0 +1,67 @@
+"""One-time migration: move embedded users.diary_entries arrays into the diary_entries collection.
+
+Usage:
+    python migrate_diary_entries.py [--dry-run] [--keep-embedded]
+
+Safe to re-run: entries previously migrated for a user are replaced, and the
+embedded array is only removed after that user's entries are inserted.
+"""
+import argparse
+import logging
+import mongo_utils
+from mongo_utils import init_mongo, ensure_indexes
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def migrate_user(user, dry_run=False, keep_embedded=False):
+    username = user["username"]
+    entries = []
+    for entry in user.get("diary_entries") or []:
+        doc = dict(entry)
+        doc["username"] = username
+        doc.setdefault("photos", [])
+        doc.setdefault("created_at", "")
+        doc["migrated_from_user"] = True
+        entries.append(doc)
+
+    if dry_run:
+        logger.info(f"[dry-run] Would migrate {len(entries)} diary entries for {username}")
+        return len(entries)
+
+    # Drop anything a previous, interrupted run already copied for this user
+    mongo_utils.diary_collection.delete_many({"username": username, "migrated_from_user": True})
+    if entries:
+        mongo_utils.diary_collection.insert_many(entries, ordered=True)
+    if not keep_embedded:
+        mongo_utils.users_collection.update_one({"_id": user["_id"]}, {"$unset": {"diary_entries": ""}})
+    logger.info(f"Migrated {len(entries)} diary entries for {username}")
+    return len(entries)
+
+def migrate(dry_run=False, keep_embedded=False):
+    init_mongo()
+    if not dry_run:
+        ensure_indexes()
+
+    users = mongo_utils.users_collection.find(
+        {"diary_entries": {"$exists": True}},
+        {"username": 1, "diary_entries": 1},
+    )
+    migrated_users = 0
+    migrated_entries = 0
+    for user in users:
+        try:
+            migrated_entries += migrate_user(user, dry_run=dry_run, keep_embedded=keep_embedded)
+            migrated_users += 1
+        except Exception as e:
+            logger.error(f"Failed to migrate diary entries for {user.get('username')}: {e}")
+
+    logger.info(f"Migration finished: {migrated_entries} entries from {migrated_users} users")
+    return migrated_users, migrated_entries
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move embedded diary entries into the diary_entries collection")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be migrated")
+    parser.add_argument("--keep-embedded", action="store_true", help="Copy entries but leave the user arrays in place")
+    args = parser.parse_args()
+    migrate(dry_run=args.dry_run, keep_embedded=args.keep_embedded)
@@ -1,12 +1,25 @@
 import joblib
-import tensorflow as tf
 import numpy as np
-from PIL import Image
-import io
+import asyncio
+import hashlib
 import re
 import requests
 import os
+import queue
+import threading
+import time
+import logging
+from collections import Counter
+from concurrent.futures import Future
 from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+from fastapi import HTTPException
+from executor import run_blocking
+from cache import TTLCache, TieredCache, create_shared_cache
+from metrics import span
+from image_preprocessing import preprocess_image, allocate_batch, ImagePreprocessingError
+from inference_backends import INFERENCE_BACKEND, default_model_path, load_inference_backend
+from inference_workers import get_inference_pool
+from routines import generate_routine  # re-exported for existing imports
 
 # URLs for the hosted model files on GitHub Releases
 cnn_model_url = 'https://github.com/SKINIQ-App/SKINIQ-backend/releases/download/v1.0/cnn_skin_model.h5'
@@ -44,100 +57,306 @@ def download_model(url, path):
             print(f"[ERROR] Unknown error during model download: {str(e)}")
             raise RuntimeError(f"Error downloading model: {str(e)}")
 
-# Download all required models and files
-download_model(cnn_model_url, cnn_model_path)
-download_model(mlp_model_url, mlp_model_path)
-download_model(tfidf_vectorizer_url, tfidf_vectorizer_path)
-download_model(mlb_encoder_url, mlb_encoder_path)
+def _load_cnn_backend(path):
+    # Backends import TensorFlow/onnxruntime themselves, so importing this module (e.g. from auth.py) stays cheap
+    backend = load_inference_backend(INFERENCE_BACKEND, path)
+    backend.warm_up()
+    return backend
 
-# Load ML Models
-try:
-    cnn_model = tf.keras.models.load_model(cnn_model_path)  # Updated to use tf.keras
-    mlp_model = joblib.load(mlp_model_path)
-    tfidf_vectorizer = joblib.load(tfidf_vectorizer_path)
-    mlb_encoder = joblib.load(mlb_encoder_path)
-except Exception as e:
-    raise RuntimeError(f"Error loading models: {str(e)}")
+class LazyModel:
+    """Downloads (when url is set) and loads a model artifact on first use or during background warm-up."""
 
-__all__ = ["cnn_model", "mlp_model", "tfidf_vectorizer", "mlb_encoder"]
+    def __init__(self, name, url, path, loader):
+        self.name = name
+        self.url = url
+        self.path = path
+        self.loader = loader
+        self.state = "not_loaded"
+        self.error = None
+        self.load_seconds = None
+        self._value = None
+        self._lock = threading.Lock()
 
-# Predict skin type from image
-def predict_skin_type(image_file):
-    try:
-        image = Image.open(image_file).convert("RGB")
-        image = image.resize((150, 150))  # match model input size
-        image_array = np.array(image) / 255.0
-        image_array = np.expand_dims(image_array, axis=0)
+    def get(self):
+        if self._value is not None:
+            return self._value
+        with self._lock:
+            if self._value is None:
+                self.state = "loading"
+                started = time.monotonic()
+                try:
+                    if self.url:
+                        download_model(self.url, self.path)
+                    self._value = self.loader(self.path)
+                except Exception as e:
+                    self.state = "failed"
+                    self.error = str(e)
+                    logger.error(f"Failed to load model {self.name}: {e}")
+                    raise RuntimeError(f"Error loading models: {str(e)}")
+                self.load_seconds = time.monotonic() - started
+                self.state = "ready"
+                self.error = None
+                logger.info(f"Model {self.name} loaded in {self.load_seconds:.2f}s")
+        return self._value
+
+    @property
+    def is_ready(self):
+        return self._value is not None
+
+    def status(self):
+        return {"state": self.state, "error": self.error, "load_seconds": self.load_seconds}
+
+logger = logging.getLogger(__name__)
+
+# Model handles; nothing is downloaded or loaded until .get() is first called
+# Exported TFLite/ONNX artifacts are produced locally by export_model.py, so only the .h5 is downloaded
+cnn_model = LazyModel(
+    "cnn_model",
+    cnn_model_url if INFERENCE_BACKEND == "keras" else None,
+    default_model_path(INFERENCE_BACKEND, cnn_model_path),
+    _load_cnn_backend,
+)
+mlp_model = LazyModel("mlp_model", mlp_model_url, mlp_model_path, joblib.load)
+tfidf_vectorizer = LazyModel("tfidf_vectorizer", tfidf_vectorizer_url, tfidf_vectorizer_path, joblib.load)
+mlb_encoder = LazyModel("mlb_encoder", mlb_encoder_url, mlb_encoder_path, joblib.load)
+
+MODEL_HANDLES = [cnn_model, mlp_model, tfidf_vectorizer, mlb_encoder]
+
+# Set MODEL_WARMUP_ON_STARTUP=0 to load models only when the first prediction arrives
+MODEL_WARMUP_ON_STARTUP = os.getenv("MODEL_WARMUP_ON_STARTUP", "1") == "1"
+
+_warm_up_thread = None
+
+def warm_up_models():
+    for handle in MODEL_HANDLES:
+        try:
+            handle.get()
+        except Exception:
+            # Already logged and recorded on the handle; keep loading the rest
+            pass
+
+def start_background_warm_up():
+    global _warm_up_thread
+    if _warm_up_thread is None or not _warm_up_thread.is_alive():
+        _warm_up_thread = threading.Thread(target=warm_up_models, name="model-warm-up", daemon=True)
+        _warm_up_thread.start()
+        logger.info("Started background model warm-up")
+
+def get_model_status():
+    pool = get_inference_pool()
+    if pool is not None:
+        # Models live in the worker processes, not in this one
+        return pool.status()
+    models = {handle.name: handle.status() for handle in MODEL_HANDLES}
+    return {
+        "ready": all(handle.is_ready for handle in MODEL_HANDLES),
+        "models": models,
+    }
+
+
+SKIN_TYPE_LABELS = ["Dry", "Normal", "Oily", "Combination", "Sensitive"]
+
+# Micro-batching knobs: a batch is flushed as soon as it holds SKIN_BATCH_MAX_SIZE
+# images or the oldest queued image has waited SKIN_BATCH_MAX_WAIT_MS.
+SKIN_BATCH_MAX_SIZE = int(os.getenv("SKIN_BATCH_MAX_SIZE", "8"))
+SKIN_BATCH_MAX_WAIT_MS = float(os.getenv("SKIN_BATCH_MAX_WAIT_MS", "10"))
+
+class SkinTypeBatcher:
+    """Queues single images and runs them through the CNN in vectorized batches."""
+
+    def __init__(self, model, max_batch_size=SKIN_BATCH_MAX_SIZE, max_wait_ms=SKIN_BATCH_MAX_WAIT_MS):
+        self.model = model
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._batch_sizes = Counter()
+        self._items = 0
+        # Reused input buffer; only the batcher thread touches it
+        self._input_buffer = allocate_batch(self.max_batch_size)
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="skin-type-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, image_array) -> Future:
+        """Queue one preprocessed (150, 150, 3) float32 image; the future resolves to its class scores."""
+        future = Future()
+        self._ensure_started()
+        self._queue.put((image_array, future))
+        return future
+
+    def predict(self, image_array):
+        return self.submit(image_array).result()
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            futures = [future for _, future in batch]
+            try:
+                inputs = self._input_buffer[:len(batch)]
+                for index, (image_array, _) in enumerate(batch):
+                    inputs[index] = image_array
+                with span("cnn_predict"):
+                    predictions = self.model.get().predict(inputs)
+            except Exception as e:
+                logger.error(f"Batched skin type prediction failed for {len(batch)} images: {e}")
+                for future in futures:
+                    future.set_exception(e)
+                continue
 
-        prediction = cnn_model.predict(image_array)
-        predicted_label = np.argmax(prediction, axis=1)[0]
+            with self._lock:
+                self._batch_sizes[len(batch)] += 1
+                self._items += len(batch)
+            for future, prediction in zip(futures, predictions):
+                future.set_result(prediction)
 
-        labels = ["Dry", "Normal", "Oily", "Combination", "Sensitive"]
-        return labels[predicted_label]
+    def stats(self):
+        with self._lock:
+            batches = sum(self._batch_sizes.values())
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "queued": self._queue.qsize(),
+                "batches": batches,
+                "items": self._items,
+                "avg_batch_size": (self._items / batches) if batches else 0.0,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+            }
+
+skin_type_batcher = SkinTypeBatcher(cnn_model)
+
+def get_batch_stats():
+    return skin_type_batcher.stats()
+
+def _submit_skin_image(image_array):
+    # Hand off to the inference worker processes when INFERENCE_WORKERS is enabled
+    pool = get_inference_pool()
+    if pool is not None:
+        return pool.submit_image(image_array)
+    return skin_type_batcher.submit(image_array)
+
+# Prediction cache keyed by a hash of the uploaded bytes and the model version, so
+# re-submitted selfies skip decode and inference. PREDICTION_CACHE_SHARED_URL adds a
+# shared tier ("redis://..." or "memory://" for the local stand-in).
+MODEL_VERSION = os.getenv("MODEL_VERSION", "v1.0")
+PREDICTION_CACHE_MAX_SIZE = int(os.getenv("PREDICTION_CACHE_MAX_SIZE", "2048"))
+PREDICTION_CACHE_TTL_SECONDS = float(os.getenv("PREDICTION_CACHE_TTL_SECONDS", "86400"))
+PREDICTION_CACHE_SHARED_URL = os.getenv("PREDICTION_CACHE_SHARED_URL", "")
+
+prediction_cache = TieredCache(
+    TTLCache(max_size=PREDICTION_CACHE_MAX_SIZE, ttl_seconds=PREDICTION_CACHE_TTL_SECONDS),
+    create_shared_cache(PREDICTION_CACHE_SHARED_URL, prefix="skiniq:prediction:"),
+)
+
+def get_prediction_cache_stats():
+    return prediction_cache.stats()
+
+def _prediction_cache_key(content_hash):
+    return f"skin_type:{MODEL_VERSION}:{INFERENCE_BACKEND}:{content_hash}"
+
+def _prepare_skin_image(image_file, content_hash=None):
+    # Returns (cache_key, cached_label, image_array); image_array is None on a cache hit.
+    # With content_hash (the upload's sha256, see upload_ingest.py) the file is only read to decode it.
+    if content_hash is None:
+        image_file = image_file if isinstance(image_file, bytes) else image_file.read()
+        content_hash = hashlib.sha256(image_file).hexdigest()
+    cache_key = _prediction_cache_key(content_hash)
+    cached_label = prediction_cache.get(cache_key)
+    if cached_label is not None:
+        return cache_key, cached_label, None
+    with span("image_preprocess"):
+        image_array = preprocess_image(image_file)
+    return cache_key, None, image_array
+
+def _label_from_prediction(prediction):
+    return SKIN_TYPE_LABELS[int(np.argmax(prediction))]
+
+# Predict skin type from image
+def predict_skin_type(image_file, content_hash=None):
+    try:
+        cache_key, label, image_array = _prepare_skin_image(image_file, content_hash)
+        if label is None:
+            prediction = _submit_skin_image(image_array).result()
+            label = _label_from_prediction(prediction)
+            prediction_cache.set(cache_key, label)
+        return label
+    except ImagePreprocessingError:
+        raise
     except Exception as e:
         raise RuntimeError(f"Error predicting skin type: {str(e)}")
 
-# Predict skin issues from text
-def predict_skin_issues(description: str):
+# Same as predict_skin_type, but awaits the batched forward pass instead of blocking the event loop
+async def predict_skin_type_async(image_file, content_hash=None):
     try:
-        if not description:
-            return []
+        cache_key, label, image_array = await run_blocking(_prepare_skin_image, image_file, content_hash)
+        if label is None:
+            # Includes time queued for the micro-batcher or a worker process
+            with span("skin_type_inference"):
+                prediction = await asyncio.wrap_future(_submit_skin_image(image_array))
+            label = _label_from_prediction(prediction)
+            prediction_cache.set(cache_key, label)
+        return label
+    except (HTTPException, ImagePreprocessingError):
+        raise
+    except Exception as e:
+        raise RuntimeError(f"Error predicting skin type: {str(e)}")
+
+# Text cleaning patterns, compiled once
+_NON_ALPHA_RE = re.compile(r"[^a-zA-Z\s]")
 
-        text = re.sub(r"[^a-zA-Z\s]", "", description.lower())
-        cleaned_text = " ".join([
-            word for word in text.split()
-            if word not in ENGLISH_STOP_WORDS
-        ])
+def clean_description(description: str):
+    text = _NON_ALPHA_RE.sub("", description.lower())
+    return " ".join(word for word in text.split() if word not in ENGLISH_STOP_WORDS)
 
-        if not cleaned_text.strip():
-            return []
+# Predict skin issues for many descriptions with one TF-IDF transform and one MLP call
+def predict_skin_issues_batch(descriptions):
+    pool = get_inference_pool()
+    if pool is not None:
+        return pool.submit_text(descriptions).result()
+    try:
+        cleaned = [clean_description(description) if description else "" for description in descriptions]
+        indices = [index for index, text in enumerate(cleaned) if text]
+        results = [[] for _ in descriptions]
+        if not indices:
+            return results
 
-        X = tfidf_vectorizer.transform([cleaned_text])
-        prediction = mlp_model.predict(X)
-        predicted_labels = mlb_encoder.inverse_transform(prediction)
+        with span("text_predict"):
+            X = tfidf_vectorizer.get().transform([cleaned[index] for index in indices])
+            prediction = mlp_model.get().predict(X)
+            predicted_labels = mlb_encoder.get().inverse_transform(prediction)
 
-        return list(predicted_labels[0])
+        for index, labels in zip(indices, predicted_labels):
+            results[index] = list(labels)
+        return results
     except Exception as e:
         raise RuntimeError(f"Error predicting skin issues: {str(e)}")
 
-# Generate skin routine
-def generate_routine(skin_type: str, issues: list):
-    routines = []
-
-    if skin_type.lower() == "dry":
-        routines.append("Use hydrating cleanser and thick moisturizer")
-    elif skin_type.lower() == "oily":
-        routines.append("Use oil-free cleanser and exfoliate regularly")
-    elif skin_type.lower() == "sensitive":
-        routines.append("Use fragrance-free, calming skincare")
-    elif skin_type.lower() == "normal":
-        routines.append("Maintain gentle routine with SPF")
-    elif skin_type.lower() == "combination":  # Fixed typo: "combinational" to "combination"
-        routines.append("Balance hydration and exfoliation in different zones")
-
-    issue_routines = {
-        "acne": "Use salicylic acid cleanser and niacinamide serum",
-        "dark circle": "Use eye cream with caffeine and hydrate well",
-        "hyperpigmentation": "Use vitamin C serum and sunscreen",
-        "blackheads": "Use BHA exfoliants twice a week",
-        "wrinkles": "Use retinol at night and SPF in day",
-        "dull skin": "Use AHA exfoliant and hydrate with hyaluronic acid",
-        "eczema": "Use thick emollient creams and avoid triggers",
-        "redness": "Use calming products with aloe or chamomile",
-        "dark spots": "Use niacinamide and brightening agents",
-    }
-
-    matched = False
-    for issue in issues:
-        for key in issue_routines:
-            if key in issue.lower():
-                routines.append(issue_routines[key])
-                matched = True
-
-    if not matched:
-        routines.append("Use gentle skincare and consult a dermatologist")
-
-    return routines
+# Predict skin issues from text
+def predict_skin_issues(description: str):
+    return predict_skin_issues_batch([description])[0]
 
 __all__ = ["cnn_model", "mlp_model", "tfidf_vectorizer", "mlb_encoder",
-           "predict_skin_type", "predict_skin_issues", "generate_routine"]
\ No newline at end of file
+           "warm_up_models", "start_background_warm_up", "get_model_status",
+           "predict_skin_type", "predict_skin_type_async", "get_batch_stats",
+           "get_prediction_cache_stats",
+           "clean_description", "predict_skin_issues", "predict_skin_issues_batch",
+           "generate_routine"]
\ No newline at end of file
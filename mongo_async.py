@@ -0,0 +1,218 @@
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+from mongo_utils import (
+    get_mongo_client_options, MONGODB_DB_NAME, INDEXES,
+    USER_EXISTS_PROJECTION, LOGIN_PROJECTION, PROFILE_PROJECTION,
+    DIARY_PAGE_SORT, diary_page_filter, build_skin_analysis_doc,
+)
+from user_cache import (
+    get_cached_user_async, cache_user_async, invalidate_user_async, cacheable_projection, user_cache_generation,
+)
+from metrics import span, timed
+import asyncio
+import logging
+import os
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Async counterpart of mongo_utils.py for use from async FastAPI routes.
+# Same function names and arguments, but every call is awaitable.
+
+client = None
+db = None
+users_collection = None
+diary_collection = None
+skin_analysis_collection = None
+
+_init_lock = asyncio.Lock()
+
+async def init_mongo():
+    global client, db, users_collection, diary_collection, skin_analysis_collection
+    if client is not None:
+        return True
+    async with _init_lock:
+        if client is not None:
+            return True
+        new_client = None
+        try:
+            connection_string = os.getenv("MONGODB_URL")
+            if not connection_string:
+                raise Exception("MONGODB_URL not set in environment")
+            new_client = AsyncIOMotorClient(connection_string, **get_mongo_client_options())
+            new_db = new_client[MONGODB_DB_NAME]
+            await new_db.command("ping")
+            db = new_db
+            users_collection = db["users"]
+            diary_collection = db["diary_entries"]
+            skin_analysis_collection = db["skin_analysis"]
+            client = new_client
+            logger.info("Connected to MongoDB (async)")
+            return True
+        except Exception as e:
+            logger.error(f"MongoDB (async) connection failed: {e}")
+            # Otherwise every request during an outage leaks a client with its monitors and pool
+            if new_client is not None:
+                new_client.close()
+            raise Exception("Failed to connect to MongoDB")
+
+async def close_mongo():
+    global client, db, users_collection, diary_collection, skin_analysis_collection
+    if client is not None:
+        client.close()
+        client = db = users_collection = diary_collection = skin_analysis_collection = None
+        logger.info("MongoDB (async) connection closed")
+
+async def ensure_indexes():
+    await init_mongo()
+    for collection_name, indexes in INDEXES.items():
+        try:
+            await db[collection_name].create_indexes(indexes)
+            logger.info(f"Indexes ensured for {collection_name}")
+        except Exception as e:
+            logger.error(f"Failed to ensure indexes for {collection_name}: {e}")
+
+@timed("mongo.create_user")
+async def create_user(user_data):
+    await init_mongo()
+    try:
+        result = await users_collection.insert_one(user_data)
+        logger.info(f"User created: {user_data.get('email')}")
+        return result
+    except Exception as e:
+        logger.error(f"Failed to create user {user_data.get('email')}: {e}")
+        raise
+
+async def get_user_by_email(email, projection=None, cached=True):
+    """cached=False reads MongoDB directly, for lookups whose result is written back."""
+    if cached:
+        user = await get_cached_user_async("email", email, projection)
+        if user is not None:
+            return user
+    generation = user_cache_generation()
+    await init_mongo()
+    try:
+        with span("mongo.get_user_by_email"):
+            user = await users_collection.find_one({"email": email}, cacheable_projection(projection))
+        if cached:
+            await cache_user_async("email", email, projection, user, generation)
+        logger.info(f"User fetch attempted for: {email}")
+        return user
+    except Exception as e:
+        logger.error(f"Failed to fetch user by email {email}: {e}")
+        raise
+
+async def get_user_by_username(username, projection=None, cached=True):
+    """cached=False reads MongoDB directly, for lookups whose result is written back."""
+    if cached:
+        user = await get_cached_user_async("username", username, projection)
+        if user is not None:
+            return user
+    generation = user_cache_generation()
+    await init_mongo()
+    try:
+        with span("mongo.get_user_by_username"):
+            user = await users_collection.find_one({"username": username}, cacheable_projection(projection))
+        if cached:
+            await cache_user_async("username", username, projection, user, generation)
+        logger.info(f"User fetch attempted for: {username}")
+        return user
+    except Exception as e:
+        logger.error(f"Failed to fetch user by username {username}: {e}")
+        raise
+
+@timed("mongo.get_existing_usernames")
+async def get_existing_usernames(usernames):
+    await init_mongo()
+    try:
+        found = users_collection.find({"username": {"$in": list(usernames)}}, {"_id": 0, "username": 1})
+        return {user["username"] async for user in found}
+    except Exception as e:
+        logger.error(f"Failed to look up {len(usernames)} usernames: {e}")
+        raise
+
+@timed("mongo.update_user_by_username")
+async def update_user_by_username(username, data, match=None):
+    """$set data on the user; match adds filter conditions, so the write can be skipped (matched_count 0)."""
+    await init_mongo()
+    try:
+        result = await users_collection.update_one({"username": username, **(match or {})}, {"$set": data})
+        await invalidate_user_async("username", username)
+        logger.info(f"User updated: {username}")
+        return result
+    except Exception as e:
+        logger.error(f"Failed to update user {username}: {e}")
+        raise
+
+@timed("mongo.save_diary_entry")
+async def save_diary_entry(entry):
+    await init_mongo()
+    try:
+        result = await diary_collection.insert_one(entry)
+        logger.info(f"Diary entry saved for {entry.get('username')}")
+        return result
+    except Exception as e:
+        logger.error(f"Failed to save diary entry for {entry.get('username')}: {e}")
+        raise
+
+@timed("mongo.get_user_diary_entries")
+async def get_user_diary_entries(username, start_date=None, end_date=None, limit=None, after_id=None):
+    await init_mongo()
+    try:
+        anchor = None
+        if after_id is not None:
+            anchor = await diary_collection.find_one({"_id": after_id, "username": username}, {"created_at": 1})
+            if anchor is None:
+                return []
+        cursor = diary_collection.find(diary_page_filter(username, start_date, end_date, anchor)).sort(DIARY_PAGE_SORT)
+        if limit:
+            cursor = cursor.limit(limit)
+        entries = await cursor.to_list(length=limit or None)
+        logger.info(f"Fetched {len(entries)} diary entries for {username}")
+        return entries
+    except Exception as e:
+        logger.error(f"Failed to fetch diary entries for {username}: {e}")
+        raise
+
+@timed("mongo.store_skin_analysis")
+async def store_skin_analysis(username, skin_type, skin_info, image_url=None, description=None):
+    await init_mongo()
+    try:
+        doc = build_skin_analysis_doc(username, skin_type, skin_info, image_url, description)
+        result = await skin_analysis_collection.insert_one(doc)
+        logger.info(f"Skin analysis stored for {username}")
+        return result
+    except Exception as e:
+        logger.error(f"Failed to store skin analysis for {username}: {e}")
+        raise
+
+@timed("mongo.store_skin_analyses")
+async def store_skin_analyses(docs):
+    await init_mongo()
+    try:
+        result = await skin_analysis_collection.insert_many(docs, ordered=False)
+        logger.info(f"Stored {len(docs)} skin analyses")
+        return result
+    except Exception as e:
+        logger.error(f"Failed to store {len(docs)} skin analyses: {e}")
+        raise
+
+@timed("mongo.update_user_by_email")
+async def update_user_by_email(email: str, update_data: dict):
+    await init_mongo()
+    try:
+        # matched_count tells us whether the user exists, so no separate lookup is needed
+        result = await users_collection.update_one({"email": email}, {"$set": update_data})
+        await invalidate_user_async("email", email)
+        if result.matched_count:
+            logger.info(f"User updated by email: {email}")
+            return True
+        logger.info(f"No user found to update for email: {email}")
+        return False
+    except Exception as e:
+        logger.error(f"Failed to update user by email {email}: {e}")
+        raise
+
+logger.info("MongoDB async utilities loaded")
@@ -1,8 +1,11 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, IndexModel, ASCENDING, DESCENDING
+from datetime import datetime
 import os
 from dotenv import load_dotenv
 import logging
 import certifi
+from user_cache import get_cached_user, cache_user, invalidate_user, cacheable_projection, user_cache_generation
+from metrics import span, timed
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -15,6 +18,56 @@ users_collection = None
 diary_collection = None
 skin_analysis_collection = None
 
+# Connection pool sizing and timeouts, shared with the async data layer in mongo_async.py
+MONGODB_DB_NAME = os.getenv("MONGODB_DB_NAME", "skincare")
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "100"))
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "0"))
+MONGODB_CONNECT_TIMEOUT_MS = int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "30000"))
+MONGODB_SOCKET_TIMEOUT_MS = int(os.getenv("MONGODB_SOCKET_TIMEOUT_MS", "30000"))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "30000"))
+
+def get_mongo_client_options():
+    return {
+        "ssl": True,
+        "tlsCAFile": certifi.where(),
+        "tlsAllowInvalidCertificates": True,  # Temporary workaround for SSL issues
+        "maxPoolSize": MONGODB_MAX_POOL_SIZE,
+        "minPoolSize": MONGODB_MIN_POOL_SIZE,
+        "connectTimeoutMS": MONGODB_CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": MONGODB_SOCKET_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+    }
+
+# Indexes ensured at startup, keyed by collection name
+INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+        IndexModel([("username", ASCENDING)], unique=True, name="username_unique"),
+    ],
+    "diary_entries": [
+        IndexModel([("username", ASCENDING), ("created_at", DESCENDING)], name="username_created_at"),
+    ],
+    "skin_analysis": [
+        IndexModel([("username", ASCENDING), ("created_at", DESCENDING)], name="username_created_at"),
+    ],
+}
+
+# Field projections so routes only fetch what they need from the (potentially large) user document
+USER_EXISTS_PROJECTION = {"_id": 1}
+LOGIN_PROJECTION = {"_id": 0, "username": 1, "email": 1, "password": 1}
+PROFILE_PROJECTION = {
+    "_id": 0,
+    "username": 1,
+    "email": 1,
+    "profile_image": 1,
+    "profile_thumbnail": 1,
+    "profile_image_status": 1,
+    "skin_details": 1,
+    "predicted_skin_type": 1,
+    "predicted_skin_issues": 1,
+    "recommended_routine": 1,
+}
+
 def init_mongo():
     global client, db, users_collection, diary_collection, skin_analysis_collection
     if client is None:
@@ -22,16 +75,8 @@ def init_mongo():
             connection_string = os.getenv("MONGODB_URL")
             if not connection_string:
                 raise Exception("MONGODB_URL not set in environment")
-            client = MongoClient(
-                connection_string,
-                ssl=True,
-                tlsCAFile=certifi.where(),
-                tlsAllowInvalidCertificates=True,  # Temporary workaround for SSL issues
-                connectTimeoutMS=30000,
-                socketTimeoutMS=30000,
-                serverSelectionTimeoutMS=30000
-            )
-            db = client["skincare"]
+            client = MongoClient(connection_string, **get_mongo_client_options())
+            db = client[MONGODB_DB_NAME]
             db.command("ping")
             users_collection = db["users"]
             diary_collection = db["diary_entries"]
@@ -44,6 +89,17 @@ def init_mongo():
             raise Exception("Failed to connect to MongoDB")
     return True
 
+def ensure_indexes():
+    if not init_mongo():
+        raise Exception("Failed to connect to MongoDB")
+    for collection_name, indexes in INDEXES.items():
+        try:
+            db[collection_name].create_indexes(indexes)
+            logger.info(f"Indexes ensured for {collection_name}")
+        except Exception as e:
+            logger.error(f"Failed to ensure indexes for {collection_name}: {e}")
+
+@timed("mongo.create_user")
 def create_user(user_data):
     if not init_mongo():
         raise Exception("Failed to connect to MongoDB")
@@ -55,39 +111,72 @@ def create_user(user_data):
         logger.error(f"Failed to create user {user_data.get('email')}: {e}")
         raise
 
-def get_user_by_email(email):
+def get_user_by_email(email, projection=None, cached=True):
+    """cached=False reads MongoDB directly, for lookups whose result is written back."""
+    if cached:
+        user = get_cached_user("email", email, projection)
+        if user is not None:
+            return user
+    generation = user_cache_generation()
     if not init_mongo():
         raise Exception("Failed to connect to MongoDB")
     try:
-        user = users_collection.find_one({"email": email})
+        with span("mongo.get_user_by_email"):
+            user = users_collection.find_one({"email": email}, cacheable_projection(projection))
+        if cached:
+            cache_user("email", email, projection, user, generation)
         logger.info(f"User fetch attempted for: {email}")
         return user
     except Exception as e:
         logger.error(f"Failed to fetch user by email {email}: {e}")
         raise
 
-def get_user_by_username(username):
+def get_user_by_username(username, projection=None, cached=True):
+    """cached=False reads MongoDB directly, for lookups whose result is written back."""
+    if cached:
+        user = get_cached_user("username", username, projection)
+        if user is not None:
+            return user
+    generation = user_cache_generation()
     if not init_mongo():
         raise Exception("Failed to connect to MongoDB")
     try:
-        user = users_collection.find_one({"username": username})
+        with span("mongo.get_user_by_username"):
+            user = users_collection.find_one({"username": username}, cacheable_projection(projection))
+        if cached:
+            cache_user("username", username, projection, user, generation)
         logger.info(f"User fetch attempted for: {username}")
         return user
     except Exception as e:
         logger.error(f"Failed to fetch user by username {username}: {e}")
         raise
 
-def update_user_by_username(username, data):
+@timed("mongo.get_existing_usernames")
+def get_existing_usernames(usernames):
     if not init_mongo():
         raise Exception("Failed to connect to MongoDB")
     try:
-        result = users_collection.update_one({"username": username}, {"$set": data})
+        found = users_collection.find({"username": {"$in": list(usernames)}}, {"_id": 0, "username": 1})
+        return {user["username"] for user in found}
+    except Exception as e:
+        logger.error(f"Failed to look up {len(usernames)} usernames: {e}")
+        raise
+
+@timed("mongo.update_user_by_username")
+def update_user_by_username(username, data, match=None):
+    """$set data on the user; match adds filter conditions, so the write can be skipped (matched_count 0)."""
+    if not init_mongo():
+        raise Exception("Failed to connect to MongoDB")
+    try:
+        result = users_collection.update_one({"username": username, **(match or {})}, {"$set": data})
+        invalidate_user("username", username)
         logger.info(f"User updated: {username}")
         return result
     except Exception as e:
         logger.error(f"Failed to update user {username}: {e}")
         raise
 
+@timed("mongo.save_diary_entry")
 def save_diary_entry(entry):
     if not init_mongo():
         raise Exception("Failed to connect to MongoDB")
@@ -99,28 +188,60 @@ def save_diary_entry(entry):
         logger.error(f"Failed to save diary entry for {entry.get('username')}: {e}")
         raise
 
-def get_user_diary_entries(username):
+DIARY_PAGE_SORT = [("created_at", DESCENDING), ("_id", DESCENDING)]
+
+def diary_page_filter(username, start_date=None, end_date=None, anchor=None):
+    # Entries are paged newest first; anchor is the last entry of the previous page
+    query = {"username": username}
+    if start_date or end_date:
+        query["date"] = {}
+        if start_date:
+            query["date"]["$gte"] = start_date
+        if end_date:
+            query["date"]["$lte"] = end_date
+    if anchor is not None:
+        query["$or"] = [
+            {"created_at": {"$lt": anchor["created_at"]}},
+            {"created_at": anchor["created_at"], "_id": {"$lt": anchor["_id"]}},
+        ]
+    return query
+
+@timed("mongo.get_user_diary_entries")
+def get_user_diary_entries(username, start_date=None, end_date=None, limit=None, after_id=None):
     if not init_mongo():
         raise Exception("Failed to connect to MongoDB")
     try:
-        entries = list(diary_collection.find({"username": username}))
+        anchor = None
+        if after_id is not None:
+            anchor = diary_collection.find_one({"_id": after_id, "username": username}, {"created_at": 1})
+            if anchor is None:
+                return []
+        cursor = diary_collection.find(diary_page_filter(username, start_date, end_date, anchor)).sort(DIARY_PAGE_SORT)
+        if limit:
+            cursor = cursor.limit(limit)
+        entries = list(cursor)
         logger.info(f"Fetched {len(entries)} diary entries for {username}")
         return entries
     except Exception as e:
         logger.error(f"Failed to fetch diary entries for {username}: {e}")
         raise
 
+def build_skin_analysis_doc(username, skin_type, skin_info, image_url=None, description=None):
+    return {
+        "username": username,
+        "skin_type": skin_type,
+        "skin_info": skin_info,
+        "image_url": image_url,
+        "description": description,
+        "created_at": datetime.utcnow().isoformat(),
+    }
+
+@timed("mongo.store_skin_analysis")
 def store_skin_analysis(username, skin_type, skin_info, image_url=None, description=None):
     if not init_mongo():
         raise Exception("Failed to connect to MongoDB")
     try:
-        doc = {
-            "username": username,
-            "skin_type": skin_type,
-            "skin_info": skin_info,
-            "image_url": image_url,
-            "description": description
-        }
+        doc = build_skin_analysis_doc(username, skin_type, skin_info, image_url, description)
         result = skin_analysis_collection.insert_one(doc)
         logger.info(f"Skin analysis stored for {username}")
         return result
@@ -128,13 +249,27 @@ def store_skin_analysis(username, skin_type, skin_info, image_url=None, descript
         logger.error(f"Failed to store skin analysis for {username}: {e}")
         raise
 
+@timed("mongo.store_skin_analyses")
+def store_skin_analyses(docs):
+    if not init_mongo():
+        raise Exception("Failed to connect to MongoDB")
+    try:
+        result = skin_analysis_collection.insert_many(docs, ordered=False)
+        logger.info(f"Stored {len(docs)} skin analyses")
+        return result
+    except Exception as e:
+        logger.error(f"Failed to store {len(docs)} skin analyses: {e}")
+        raise
+
+@timed("mongo.update_user_by_email")
 def update_user_by_email(email: str, update_data: dict):
     if not init_mongo():
         raise Exception("Failed to connect to MongoDB")
     try:
-        user = get_user_by_email(email)
-        if user:
-            result = users_collection.update_one({"email": email}, {"$set": update_data})
+        # matched_count tells us whether the user exists, so no separate lookup is needed
+        result = users_collection.update_one({"email": email}, {"$set": update_data})
+        invalidate_user("email", email)
+        if result.matched_count:
             logger.info(f"User updated by email: {email}")
             return True
         logger.info(f"No user found to update for email: {email}")
@@ -0,0 +1,112 @@
+from concurrent.futures import ProcessPoolExecutor
+from fastapi import HTTPException
+from passlib.hash import bcrypt
+from executor import run_blocking, EXECUTOR_RETRY_AFTER_SECONDS
+import asyncio
+import multiprocessing
+import threading
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# bcrypt is deliberately slow, so hashing runs on its own bounded process pool instead of
+# the shared blocking executor; a login storm then queues here (429 once
+# PASSWORD_HASH_MAX_QUEUE calls are waiting) without starving inference or Mongo calls.
+# PASSWORD_HASH_WORKERS=0 falls back to the shared thread executor.
+# Raising BCRYPT_ROUNDS takes effect for existing users on their next successful login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64"))
+
+_pool = None
+_pool_lock = threading.Lock()
+_pending = 0
+_pending_lock = threading.Lock()
+
+def _hasher(rounds):
+    return bcrypt.using(rounds=rounds)
+
+def hash_password_sync(password, rounds=BCRYPT_ROUNDS):
+    return _hasher(rounds).hash(password)
+
+def verify_password_sync(password, hashed, rounds=BCRYPT_ROUNDS):
+    """Return (matches, new_hash); new_hash is set when the stored hash used a different cost."""
+    hasher = _hasher(rounds)
+    if not hasher.verify(password, hashed):
+        return False, None
+    if hasher.needs_update(hashed):
+        return True, hasher.hash(password)
+    return True, None
+
+def get_password_pool():
+    global _pool
+    if _pool is None and PASSWORD_HASH_WORKERS > 0:
+        with _pool_lock:
+            if _pool is None:
+                # spawn, not fork: the parent may already hold TensorFlow state
+                _pool = ProcessPoolExecutor(
+                    max_workers=PASSWORD_HASH_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                logger.info(f"Started password hashing pool with {PASSWORD_HASH_WORKERS} processes, {BCRYPT_ROUNDS} rounds")
+    return _pool
+
+def _try_acquire_slot():
+    global _pending
+    with _pending_lock:
+        if _pending >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE:
+            return False
+        _pending += 1
+        return True
+
+def _release_slot():
+    global _pending
+    with _pending_lock:
+        _pending -= 1
+
+async def _run(func, *args):
+    pool = get_password_pool()
+    if pool is None:
+        return await run_blocking(func, *args)
+    if not _try_acquire_slot():
+        logger.warning("Password hashing pool saturated, rejecting request")
+        raise HTTPException(
+            status_code=429,
+            detail="Server is busy, please retry shortly",
+            headers={"Retry-After": EXECUTOR_RETRY_AFTER_SECONDS},
+        )
+    try:
+        future = pool.submit(func, *args)
+    except BaseException:
+        _release_slot()
+        raise
+    # Released when the worker process is done, not when the caller stops waiting
+    future.add_done_callback(lambda _: _release_slot())
+    return await asyncio.wrap_future(future)
+
+async def hash_password(password):
+    return await _run(hash_password_sync, password, BCRYPT_ROUNDS)
+
+async def verify_password(password, hashed):
+    """Check a password off the event loop; returns (matches, new_hash or None)."""
+    return await _run(verify_password_sync, password, hashed, BCRYPT_ROUNDS)
+
+def password_pool_stats():
+    with _pending_lock:
+        pending = _pending
+    return {
+        "workers": PASSWORD_HASH_WORKERS,
+        "max_queue": PASSWORD_HASH_MAX_QUEUE,
+        "pending": pending,
+        "rounds": BCRYPT_ROUNDS,
+        "started": _pool is not None,
+    }
+
+def shutdown_password_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
+            logger.info("Password hashing pool shut down")
@@ -0,0 +1,66 @@
+"""Offline job: re-score stored skin_analysis descriptions with the current text model.
+
+Usage:
+    python rescore_skin_analysis.py [--batch-size 512] [--username NAME] [--dry-run]
+
+Descriptions are cleaned and predicted in batches (one TF-IDF transform and one MLP call
+per batch), and results are written back with one bulk_write per batch.
+"""
+import argparse
+import logging
+from datetime import datetime
+from pymongo import UpdateOne
+import mongo_utils
+from mongo_utils import init_mongo
+from models import predict_skin_issues_batch, MODEL_VERSION
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def _flush(batch, dry_run):
+    predictions = predict_skin_issues_batch([doc["description"] for doc in batch])
+    if dry_run:
+        return len(batch)
+    rescored_at = datetime.utcnow().isoformat()
+    operations = [
+        UpdateOne(
+            {"_id": doc["_id"]},
+            {"$set": {
+                "predicted_skin_issues": issues,
+                "rescored_model_version": MODEL_VERSION,
+                "rescored_at": rescored_at,
+            }},
+        )
+        for doc, issues in zip(batch, predictions)
+    ]
+    mongo_utils.skin_analysis_collection.bulk_write(operations, ordered=False)
+    return len(batch)
+
+def rescore(batch_size=512, username=None, dry_run=False):
+    init_mongo()
+    query = {"description": {"$nin": [None, ""]}}
+    if username:
+        query["username"] = username
+
+    cursor = mongo_utils.skin_analysis_collection.find(query, {"description": 1}).batch_size(batch_size)
+    batch = []
+    rescored = 0
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            rescored += _flush(batch, dry_run)
+            batch = []
+            logger.info(f"Rescored {rescored} skin analyses so far")
+    if batch:
+        rescored += _flush(batch, dry_run)
+
+    logger.info(f"Rescoring finished: {rescored} skin analyses{' (dry run)' if dry_run else ''}")
+    return rescored
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-score stored skin_analysis descriptions")
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--username", help="Only rescore this user's analyses")
+    parser.add_argument("--dry-run", action="store_true", help="Predict but do not write results")
+    args = parser.parse_args()
+    rescore(batch_size=args.batch_size, username=args.username, dry_run=args.dry_run)
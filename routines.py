@@ -0,0 +1,59 @@
+from functools import lru_cache
+
+# Routine rules. Skin types match exactly (case-insensitive); issue rules match when the
+# keyword appears anywhere in a predicted issue label, in the order listed here.
+SKIN_TYPE_RULES = {
+    "dry": "Use hydrating cleanser and thick moisturizer",
+    "oily": "Use oil-free cleanser and exfoliate regularly",
+    "sensitive": "Use fragrance-free, calming skincare",
+    "normal": "Maintain gentle routine with SPF",
+    "combination": "Balance hydration and exfoliation in different zones",
+}
+
+ISSUE_RULES = (
+    ("acne", "Use salicylic acid cleanser and niacinamide serum"),
+    ("dark circle", "Use eye cream with caffeine and hydrate well"),
+    ("hyperpigmentation", "Use vitamin C serum and sunscreen"),
+    ("blackheads", "Use BHA exfoliants twice a week"),
+    ("wrinkles", "Use retinol at night and SPF in day"),
+    ("dull skin", "Use AHA exfoliant and hydrate with hyaluronic acid"),
+    ("eczema", "Use thick emollient creams and avoid triggers"),
+    ("redness", "Use calming products with aloe or chamomile"),
+    ("dark spots", "Use niacinamide and brightening agents"),
+)
+
+DEFAULT_ISSUE_ROUTINE = "Use gentle skincare and consult a dermatologist"
+
+ROUTINE_CACHE_SIZE = 4096
+
+@lru_cache(maxsize=ROUTINE_CACHE_SIZE)
+def _matching_rules(issue: str):
+    # Issue keyword index: rule positions whose keyword occurs in this (normalized) issue label
+    return frozenset(position for position, (keyword, _) in enumerate(ISSUE_RULES) if keyword in issue)
+
+@lru_cache(maxsize=ROUTINE_CACHE_SIZE)
+def _routine_for(skin_type: str, issues: frozenset):
+    routines = []
+    if skin_type in SKIN_TYPE_RULES:
+        routines.append(SKIN_TYPE_RULES[skin_type])
+
+    positions = set()
+    for issue in issues:
+        positions |= _matching_rules(issue)
+    if positions:
+        routines.extend(ISSUE_RULES[position][1] for position in sorted(positions))
+    else:
+        routines.append(DEFAULT_ISSUE_ROUTINE)
+    return tuple(routines)
+
+# Generate skin routine
+def generate_routine(skin_type: str, issues: list):
+    normalized_type = (skin_type or "").strip().lower()
+    normalized_issues = frozenset(issue.lower() for issue in issues or [] if issue)
+    return list(_routine_for(normalized_type, normalized_issues))
+
+def routine_cache_info():
+    return {
+        "routines": _routine_for.cache_info()._asdict(),
+        "issue_index": _matching_rules.cache_info()._asdict(),
+    }
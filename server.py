@@ -1,7 +1,8 @@
 from fastapi import FastAPI, HTTPException, status
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, Response
+from fastapi.responses import HTMLResponse, JSONResponse, Response
+from metrics import MetricsMiddleware, callback_gauge, render_metrics
 import logging
 import os
 
@@ -22,6 +23,84 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Added last so it is outermost and times the whole request, CORS included
+app.add_middleware(MetricsMiddleware)
+
+@app.on_event("startup")
+def start_model_warm_up():
+    from inference_workers import INFERENCE_WORKERS, start_inference_workers
+    from models import MODEL_WARMUP_ON_STARTUP, start_background_warm_up
+    if INFERENCE_WORKERS > 0:
+        # Worker processes load and warm up their own models
+        start_inference_workers()
+    elif MODEL_WARMUP_ON_STARTUP:
+        start_background_warm_up()
+
+@app.on_event("shutdown")
+def stop_inference_worker_pool():
+    from inference_workers import stop_inference_workers
+    stop_inference_workers()
+
+@app.on_event("startup")
+async def connect_mongo():
+    from mongo_async import init_mongo, ensure_indexes
+    from local_standins import LOCAL_STANDINS, start_local_standins
+    if LOCAL_STANDINS:
+        # In-memory Mongo, local file storage and SMTP sink; init_mongo then finds the client set
+        start_local_standins()
+    try:
+        await init_mongo()
+        await ensure_indexes()
+    except Exception as e:
+        # Routes retry the connection lazily, so a failed ping must not stop the app from booting
+        logger.error(f"MongoDB startup connection failed: {e}")
+
+    from write_behind import get_skin_analysis_writer
+    await get_skin_analysis_writer().start()
+
+@app.on_event("startup")
+async def start_job_queue():
+    from jobs import get_job_queue
+    await get_job_queue().start()
+
+@app.on_event("shutdown")
+async def stop_job_queue():
+    from jobs import get_job_queue
+    # Before Mongo closes, since running jobs write to it
+    await get_job_queue().stop()
+
+@app.on_event("shutdown")
+async def finish_background_uploads():
+    from storage import drain_background_uploads
+    # Runs before the Mongo connection closes: finished uploads still write their URLs
+    await drain_background_uploads()
+
+@app.on_event("shutdown")
+async def close_mongo_connection():
+    from mongo_async import close_mongo
+    from write_behind import get_skin_analysis_writer
+    # Drain buffered history writes while the connection is still open
+    await get_skin_analysis_writer().stop()
+    await close_mongo()
+
+@app.on_event("shutdown")
+def stop_email_senders():
+    from your_email_module import stop_email_queue
+    # Give queued OTP / reset emails a chance to go out before the process exits
+    stop_email_queue()
+    from local_standins import stop_local_standins
+    stop_local_standins()
+
+@app.on_event("shutdown")
+def shutdown_password_hashing_pool():
+    from passwords import shutdown_password_pool
+    shutdown_password_pool()
+
+@app.on_event("shutdown")
+def shutdown_blocking_executor():
+    from executor import shutdown_executor
+    shutdown_executor()
+
 # Suppress favicon request errors
 @app.get("/favicon.ico")
 async def get_favicon():
@@ -59,6 +138,53 @@ except Exception as e:
 def read_root():
     return {"message": "Skincare API is running"}
 
+@app.get("/ready")
+def readiness():
+    # Per-model load state; 503 until every model is loaded so traffic is only routed to warm instances
+    from models import get_model_status
+    model_status = get_model_status()
+    if not model_status["ready"]:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=model_status)
+    return model_status
+
+@app.get("/cache-stats")
+def cache_stats():
+    from user_cache import user_cache_stats
+    from models import get_prediction_cache_stats
+    from routines import routine_cache_info
+    return {
+        "users": user_cache_stats(),
+        "predictions": get_prediction_cache_stats(),
+        "routines": routine_cache_info(),
+    }
+
+# Queue depths are read when /metrics is scraped; modules are imported lazily so a
+# failed model import does not break the metrics endpoint
+def _executor_pending():
+    from executor import executor_stats
+    return executor_stats()["pending"]
+
+def _skin_batch_queued():
+    from models import get_batch_stats
+    return get_batch_stats()["queued"]
+
+def _write_behind_pending():
+    from write_behind import get_skin_analysis_writer
+    return get_skin_analysis_writer().stats()["pending"]
+
+callback_gauge("skiniq_executor_pending", "Blocking calls running or queued on the shared executor", _executor_pending)
+callback_gauge("skiniq_skin_batch_queued", "Images waiting for the skin type micro-batcher", _skin_batch_queued)
+callback_gauge("skiniq_write_behind_pending", "Skin analysis documents waiting to be written", _write_behind_pending)
+
+@app.get("/metrics")
+def metrics():
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/email-stats")
+def email_stats():
+    from your_email_module import email_queue
+    return email_queue.stats()
+
 @app.get("/profile/")
 def get_all_profiles():
     logger.info("Fetching all profiles")
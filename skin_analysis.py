@@ -1,15 +1,33 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Query
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, UploadFile, File, Query, Depends
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
 from typing import Optional, List
-from mongo_utils import update_user_by_username, get_user_by_username, store_skin_analysis
-from models import predict_skin_type, predict_skin_issues, generate_routine
+from mongo_async import (
+    update_user_by_username, get_user_by_username, get_existing_usernames,
+    USER_EXISTS_PROJECTION,
+)
+from models import (
+    predict_skin_type_async, predict_skin_issues, predict_skin_issues_batch,
+    get_batch_stats, get_prediction_cache_stats,
+)
+from executor import run_blocking
+from routines import generate_routine
+from write_behind import record_skin_analysis
+from tokens import optional_token_claims, check_token_subject
+from image_preprocessing import ImageTooLargeError, InvalidImageError
+from upload_ingest import ingest_image_upload
+from jobs import get_job_queue, register_job_handler, JOB_SUCCEEDED, JOB_FAILED
+import asyncio
 import logging
+import os
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 skin_router = APIRouter(prefix="/skin")
 
+BULK_QUESTIONNAIRE_MAX_ITEMS = int(os.getenv("BULK_QUESTIONNAIRE_MAX_ITEMS", "100"))
+
 class SkinDetails(BaseModel):
     username: str
     gender: str
@@ -25,105 +43,258 @@ class SkinAnalysisResponse(BaseModel):
     skin_issues: List[str]
     routine: List[str]
 
-@skin_router.post("/analyze")
-async def analyze_skin(username: str = Query(...), file: UploadFile = File(...)):
-    logger.info(f"Received skin analysis request for username: {username}, file: {file.filename}")
-    try:
-        # Validate username
-        if not username or username.strip() == "":
-            logger.warning("Invalid username provided for skin analysis")
-            raise HTTPException(status_code=400, detail="Username is required")
-
-        # Validate file
-        if not file.filename:
-            logger.warning("No file provided for skin analysis")
-            raise HTTPException(status_code=400, detail="No file provided")
-
-        # Check file content
-        content = await file.read()
-        if not content:
-            logger.warning("Empty file provided for skin analysis")
-            raise HTTPException(status_code=400, detail="File is empty")
-        file.file.seek(0)  # Reset file pointer after reading
-
-        user = get_user_by_username(username)
+class BulkQuestionnaireRequest(BaseModel):
+    items: List[SkinDetails] = Field(..., min_length=1)
+
+class BulkQuestionnaireItem(BaseModel):
+    username: str
+    status: str
+    result: Optional[SkinAnalysisResponse] = None
+    error: Optional[str] = None
+
+def build_skin_info(details: SkinDetails):
+    return {
+        "gender": details.gender,
+        "age": details.age,
+        "skin_type": details.skinType,
+        "concerns": details.skinConcerns,
+        "diseases": details.skinConditionDiseases,
+        "breakouts": details.skinBreakouts,
+        "description": details.skinDescription
+    }
+
+async def save_questionnaire_result(details: SkinDetails, skin_info, skin_issues):
+    # The profile routine also depends on predicted_skin_type, which an image analysis may be
+    # changing concurrently; clear it and let the next profile read recompute it from the
+    # stored inputs (see get_profile)
+    update_data = {
+        "skin_details": skin_info,
+        "predicted_skin_issues": skin_issues,
+        "recommended_routine": None
+    }
+    await update_user_by_username(details.username, update_data)
+
+    # Store analysis; the history insert is batched behind the request
+    await record_skin_analysis(details.username, details.skinType, skin_info, description=details.skinDescription)
+
+async def run_image_analysis(username: str, upload):
+    """Predict the skin type for an ingested upload and store it; closes the upload."""
+    with upload:
+        user = await get_user_by_username(username, USER_EXISTS_PROJECTION, cached=False)
         if not user:
             logger.warning(f"User not found: {username}")
             raise HTTPException(status_code=404, detail="User not found")
 
         # Predict skin type from image
         try:
-            skin_type = predict_skin_type(file.file)
+            with upload.open() as image_file:
+                skin_type = await predict_skin_type_async(image_file, upload.sha256)
+        except HTTPException:
+            raise
+        except ImageTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except InvalidImageError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         except Exception as e:
             logger.error(f"Failed to predict skin type for {username}: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Skin type prediction failed: {str(e)}")
-        
-        # Fallback routine if prediction fails
-        routine = ["Use gentle cleanser and moisturizer daily"]
-        skin_issues = []
-
-        # Update user data
-        update_data = {"predicted_skin_type": skin_type}
-        update_user_by_username(username, update_data)
-        
-        # Store analysis
-        store_skin_analysis(username, skin_type, {"source": "image"})
-
-        # Generate routine
-        routine = generate_routine(skin_type, skin_issues)
-
-        logger.info(f"Skin analysis completed for {username}: {skin_type}")
-        return SkinAnalysisResponse(
-            skin_type=skin_type,
-            skin_issues=skin_issues,
-            routine=routine
-        )
+
+    # Fallback routine if prediction fails
+    routine = ["Use gentle cleanser and moisturizer daily"]
+    skin_issues = []
+
+    # Update user data; the profile routine is recomputed from the stored inputs on the next profile read
+    update_data = {
+        "predicted_skin_type": skin_type,
+        "recommended_routine": None
+    }
+    await update_user_by_username(username, update_data)
+
+    # Store analysis; the history insert is batched behind the request
+    await record_skin_analysis(username, skin_type, {"source": "image"})
+
+    # Generate routine
+    routine = generate_routine(skin_type, skin_issues)
+
+    logger.info(f"Skin analysis completed for {username}: {skin_type}")
+    return SkinAnalysisResponse(
+        skin_type=skin_type,
+        skin_issues=skin_issues,
+        routine=routine
+    )
+
+async def ingest_analysis_upload(username: str, file: UploadFile, claims, **limits):
+    # Validate username
+    if not username or username.strip() == "":
+        logger.warning("Invalid username provided for skin analysis")
+        raise HTTPException(status_code=400, detail="Username is required")
+    check_token_subject(username, claims)
+
+    # Validate file
+    if not file.filename:
+        logger.warning("No file provided for skin analysis")
+        raise HTTPException(status_code=400, detail="No file provided")
+
+    # Stream the upload once: size, type and pixel limits are checked before it is fully read
+    return await ingest_image_upload(file, **limits)
+
+@skin_router.post("/analyze")
+async def analyze_skin(username: str = Query(...), file: UploadFile = File(...), claims: Optional[dict] = Depends(optional_token_claims)):
+    logger.info(f"Received skin analysis request for username: {username}, file: {file.filename}")
+    try:
+        upload = await ingest_analysis_upload(username, file, claims)
+        return await run_image_analysis(username, upload)
     except HTTPException as he:
         raise he
     except Exception as e:
         logger.error(f"Skin analysis failed for {username}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Skin analysis failed: {str(e)}")
 
+@skin_router.get("/batch-stats")
+async def batch_stats():
+    # Achieved CNN batch sizes, used to tune SKIN_BATCH_MAX_SIZE / SKIN_BATCH_MAX_WAIT_MS
+    return get_batch_stats()
+
+@skin_router.get("/prediction-cache-stats")
+async def prediction_cache_stats():
+    return get_prediction_cache_stats()
+
+async def run_questionnaire(details: SkinDetails):
+    user = await get_user_by_username(details.username, USER_EXISTS_PROJECTION, cached=False)
+    if not user:
+        logger.warning(f"User not found: {details.username}")
+        raise HTTPException(status_code=404, detail="User not found")
+
+    # Predict skin issues from description
+    skin_issues = await run_blocking(predict_skin_issues, details.skinDescription)
+
+    # Save skin details
+    skin_info = build_skin_info(details)
+    await save_questionnaire_result(details, skin_info, skin_issues)
+
+    # Generate routine
+    routine = generate_routine(details.skinType, skin_issues)
+
+    logger.info(f"Questionnaire processed for {details.username}")
+    return SkinAnalysisResponse(
+        skin_type=details.skinType,
+        skin_issues=skin_issues,
+        routine=routine
+    )
+
 @skin_router.post("/questionnaire")
-async def process_questionnaire(details: SkinDetails):
+async def process_questionnaire(details: SkinDetails, claims: Optional[dict] = Depends(optional_token_claims)):
     try:
-        user = get_user_by_username(details.username)
-        if not user:
-            logger.warning(f"User not found: {details.username}")
-            raise HTTPException(status_code=404, detail="User not found")
-
-        # Predict skin issues from description
-        skin_issues = predict_skin_issues(details.skinDescription)
-
-        # Save skin details
-        skin_info = {
-            "gender": details.gender,
-            "age": details.age,
-            "skin_type": details.skinType,
-            "concerns": details.skinConcerns,
-            "diseases": details.skinConditionDiseases,
-            "breakouts": details.skinBreakouts,
-            "description": details.skinDescription
-        }
-
-        update_data = {
-            "skin_details": skin_info,
-            "predicted_skin_issues": skin_issues
-        }
-        update_user_by_username(details.username, update_data)
-
-        # Store analysis
-        store_skin_analysis(details.username, details.skinType, skin_info, description=details.skinDescription)
-
-        # Generate routine
-        routine = generate_routine(details.skinType, skin_issues)
-
-        logger.info(f"Questionnaire processed for {details.username}")
-        return SkinAnalysisResponse(
-            skin_type=details.skinType,
-            skin_issues=skin_issues,
-            routine=routine
-        )
+        check_token_subject(details.username, claims)
+        return await run_questionnaire(details)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Questionnaire processing failed for {details.username}: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Questionnaire processing failed: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Questionnaire processing failed: {str(e)}")
+
+@skin_router.post("/questionnaire/bulk")
+async def process_questionnaire_bulk(request: BulkQuestionnaireRequest, claims: Optional[dict] = Depends(optional_token_claims)):
+    items = request.items
+    if len(items) > BULK_QUESTIONNAIRE_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_QUESTIONNAIRE_MAX_ITEMS} items per request")
+    logger.info(f"Processing bulk questionnaire with {len(items)} items")
+    try:
+        existing = await get_existing_usernames({details.username for details in items})
+
+        # One vectorized prediction for every description in the request
+        all_issues = await run_blocking(predict_skin_issues_batch, [details.skinDescription for details in items])
+
+        async def save_item(details, skin_issues):
+            # Same rule as check_token_subject, per item: a token only covers its own user
+            if claims is not None and claims["sub"] != details.username:
+                logger.warning(f"Token for {claims['sub']} used on {details.username} in bulk questionnaire")
+                return BulkQuestionnaireItem(username=details.username, status="error", error="Token does not match user")
+            if details.username not in existing:
+                return BulkQuestionnaireItem(username=details.username, status="error", error="User not found")
+            try:
+                await save_questionnaire_result(details, build_skin_info(details), skin_issues)
+            except Exception as e:
+                logger.error(f"Bulk questionnaire save failed for {details.username}: {str(e)}")
+                return BulkQuestionnaireItem(username=details.username, status="error", error=str(e))
+            return BulkQuestionnaireItem(
+                username=details.username,
+                status="ok",
+                result=SkinAnalysisResponse(
+                    skin_type=details.skinType,
+                    skin_issues=skin_issues,
+                    routine=generate_routine(details.skinType, skin_issues)
+                )
+            )
+
+        results = await asyncio.gather(*(save_item(details, issues) for details, issues in zip(items, all_issues)))
+        logger.info(f"Bulk questionnaire processed: {sum(item.status == 'ok' for item in results)}/{len(results)} succeeded")
+        return {"results": results}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Bulk questionnaire processing failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Bulk questionnaire processing failed: {str(e)}")
+
+# --- Job-based variants: queue the work, answer with a job id, poll for the result ---
+
+async def _analyze_job(payload):
+    username, upload = payload
+    return await run_image_analysis(username, upload)
+
+async def _questionnaire_job(details):
+    return await run_questionnaire(details)
+
+register_job_handler("analyze", _analyze_job, discard=lambda payload: payload[1].close())
+register_job_handler("questionnaire", _questionnaire_job)
+
+def _job_accepted(job):
+    return JSONResponse(status_code=202, content={
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/skin/jobs/{job.id}",
+        "result_url": f"/skin/jobs/{job.id}/result",
+    })
+
+def _get_job_for(job_id, claims):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    check_token_subject(job.username, claims)
+    return job
+
+@skin_router.post("/jobs/analyze", status_code=202)
+async def submit_analyze_job(username: str = Query(...), file: UploadFile = File(...), claims: Optional[dict] = Depends(optional_token_claims)):
+    logger.info(f"Received skin analysis job for username: {username}, file: {file.filename}")
+    # The upload has to be read now: the request body is gone once the response is sent. It
+    # goes straight to a temp file, so a full queue holds its images on disk rather than in RAM
+    upload = await ingest_analysis_upload(username, file, claims, spool_max_memory=0)
+    try:
+        job = get_job_queue().submit("analyze", username, (username, upload))
+    except Exception:
+        upload.close()
+        raise
+    return _job_accepted(job)
+
+@skin_router.post("/jobs/questionnaire", status_code=202)
+async def submit_questionnaire_job(details: SkinDetails, claims: Optional[dict] = Depends(optional_token_claims)):
+    check_token_subject(details.username, claims)
+    job = get_job_queue().submit("questionnaire", details.username, details)
+    return _job_accepted(job)
+
+@skin_router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str, claims: Optional[dict] = Depends(optional_token_claims)):
+    return _get_job_for(job_id, claims).to_dict()
+
+@skin_router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str, claims: Optional[dict] = Depends(optional_token_claims)):
+    job = _get_job_for(job_id, claims)
+    if job.status == JOB_SUCCEEDED:
+        return job.result
+    if job.status == JOB_FAILED:
+        raise HTTPException(status_code=job.error_status_code or 500, detail=job.error)
+    return JSONResponse(status_code=202, content=job.to_dict(include_result=False))
+
+@skin_router.get("/job-stats")
+async def job_stats():
+    return get_job_queue().stats()
@@ -0,0 +1,154 @@
+from dotenv import load_dotenv
+load_dotenv()
+
+from abc import ABC, abstractmethod
+from cloudinary_utils import upload_image_to_cloudinary
+from executor import run_blocking
+from metrics import timed
+import asyncio
+import logging
+import os
+import shutil
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# STORAGE_BACKEND selects where uploaded images go: "cloudinary" (default) or "local",
+# which writes to LOCAL_STORAGE_DIR so uploads can be benchmarked without network access.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "cloudinary").lower()
+LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR", "local_uploads")
+LOCAL_STORAGE_BASE_URL = os.getenv("LOCAL_STORAGE_BASE_URL", "")
+
+UPLOAD_MAX_CONCURRENCY = int(os.getenv("UPLOAD_MAX_CONCURRENCY", "4"))
+UPLOAD_TIMEOUT_SECONDS = float(os.getenv("UPLOAD_TIMEOUT_SECONDS", "30"))
+UPLOAD_MAX_RETRIES = int(os.getenv("UPLOAD_MAX_RETRIES", "2"))
+UPLOAD_RETRY_BACKOFF_SECONDS = float(os.getenv("UPLOAD_RETRY_BACKOFF_SECONDS", "0.5"))
+
+class StorageBackend(ABC):
+    """Stores an image (file object or bytes) and returns a URL for it."""
+
+    name = "base"
+
+    @abstractmethod
+    def upload(self, file_data, filename=None):
+        raise NotImplementedError
+
+class CloudinaryStorage(StorageBackend):
+    name = "cloudinary"
+
+    def upload(self, file_data, filename=None):
+        return upload_image_to_cloudinary(file_data, filename=filename)
+
+class LocalFileStorage(StorageBackend):
+    name = "local"
+
+    def __init__(self, root=LOCAL_STORAGE_DIR, base_url=LOCAL_STORAGE_BASE_URL):
+        self.root = root
+        self.base_url = base_url.rstrip("/")
+        os.makedirs(self.root, exist_ok=True)
+
+    def upload(self, file_data, filename=None):
+        # Uploaded names are untrusted, so only the extension is kept
+        extension = os.path.splitext(filename or "")[1].lower()[:8]
+        stored_name = f"{uuid.uuid4().hex}{extension}"
+        path = os.path.join(self.root, stored_name)
+        with open(path, "wb") as f:
+            if isinstance(file_data, (bytes, bytearray, memoryview)):
+                f.write(file_data)
+            else:
+                shutil.copyfileobj(file_data, f)
+        if self.base_url:
+            return f"{self.base_url}/{stored_name}"
+        return f"file://{os.path.abspath(path)}"
+
+_backend = None
+
+def get_storage_backend():
+    global _backend
+    if _backend is None:
+        if STORAGE_BACKEND == "local":
+            _backend = LocalFileStorage()
+        elif STORAGE_BACKEND == "cloudinary":
+            _backend = CloudinaryStorage()
+        else:
+            raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+        logger.info(f"Using {_backend.name} storage backend")
+    return _backend
+
+def set_storage_backend(backend):
+    global _backend
+    _backend = backend
+
+def _upload_attempt(backend, file_data, filename):
+    if callable(file_data):
+        # Each attempt reads through its own file object, opened and closed on the worker thread
+        with file_data() as reader:
+            return backend.upload(reader, filename)
+    if hasattr(file_data, "seek"):
+        file_data.seek(0)
+    return backend.upload(file_data, filename)
+
+@timed("storage_upload")
+async def upload_image(file_data, filename=None, backend=None,
+                       timeout=UPLOAD_TIMEOUT_SECONDS, retries=UPLOAD_MAX_RETRIES):
+    """Upload one image with a per-attempt timeout and exponential backoff between retries.
+
+    file_data is bytes, a callable returning a new file object (e.g. IngestedUpload.open), or
+    a file object. A timed-out attempt keeps running on its thread, so a plain file object is
+    not retried after a timeout: a second attempt would race the first on the same position.
+    """
+    backend = backend or get_storage_backend()
+    shared_reader = not callable(file_data) and not isinstance(file_data, (bytes, bytearray, memoryview))
+    last_error = None
+    for attempt in range(retries + 1):
+        if attempt:
+            await asyncio.sleep(UPLOAD_RETRY_BACKOFF_SECONDS * (2 ** (attempt - 1)))
+        try:
+            return await asyncio.wait_for(run_blocking(_upload_attempt, backend, file_data, filename), timeout=timeout)
+        except asyncio.TimeoutError:
+            last_error = TimeoutError(f"Upload timed out after {timeout}s")
+            if shared_reader:
+                logger.warning(f"Upload timed out for {filename}; not retrying while the attempt still holds the file")
+                break
+        except Exception as e:
+            last_error = e
+        logger.warning(f"Upload attempt {attempt + 1}/{retries + 1} failed for {filename}: {last_error}")
+    raise RuntimeError(f"Upload failed for {filename}: {last_error}")
+
+async def upload_images(files, backend=None, max_concurrency=UPLOAD_MAX_CONCURRENCY):
+    """Upload (file_data, filename) pairs concurrently.
+
+    Returns one result per input, in order: {"filename", "url", "error"}, where exactly
+    one of url/error is set, so callers can keep the successful uploads and report the rest.
+    """
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def upload_one(file_data, filename):
+        async with semaphore:
+            try:
+                url = await upload_image(file_data, filename, backend=backend)
+                return {"filename": filename, "url": url, "error": None}
+            except Exception as e:
+                logger.error(f"Giving up on upload of {filename}: {e}")
+                return {"filename": filename, "url": None, "error": str(e)}
+
+    return await asyncio.gather(*(upload_one(file_data, filename) for file_data, filename in files))
+
+# Uploads finishing after their response was sent (see /auth/upload-skin-photo); tracked so
+# they are not garbage collected mid-flight and can be drained on shutdown
+_background_uploads = set()
+
+def track_background_upload(task):
+    _background_uploads.add(task)
+    task.add_done_callback(_background_uploads.discard)
+    return task
+
+async def drain_background_uploads(timeout=UPLOAD_TIMEOUT_SECONDS):
+    if not _background_uploads:
+        return
+    logger.info(f"Waiting for {len(_background_uploads)} background uploads")
+    done, pending = await asyncio.wait(set(_background_uploads), timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        logger.error(f"Cancelled {len(pending)} background uploads still running at shutdown")
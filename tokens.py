@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+from typing import Optional
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from jose import jwt, JWTError, ExpiredSignatureError
+from mongo_async import get_user_by_username, USER_EXISTS_PROJECTION
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Session tokens are signed with the same secret as password reset links. Keys are read once
+# at import; during a rotation, tokens signed with a key listed in JWT_PREVIOUS_SECRET_KEYS
+# (comma separated) are still accepted until they expire.
+JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
+JWT_ALGORITHM = "HS256"
+JWT_PREVIOUS_SECRET_KEYS = [key for key in os.getenv("JWT_PREVIOUS_SECRET_KEYS", "").split(",") if key]
+ACCESS_TOKEN_EXPIRY_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRY_MINUTES", "15"))
+REFRESH_TOKEN_EXPIRY_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRY_DAYS", "30"))
+
+ACCESS_TOKEN_TYPE = "access"
+REFRESH_TOKEN_TYPE = "refresh"
+SESSION_TOKEN_TYPES = (ACCESS_TOKEN_TYPE, REFRESH_TOKEN_TYPE)
+
+_VERIFICATION_KEYS = [key for key in [JWT_SECRET_KEY, *JWT_PREVIOUS_SECRET_KEYS] if key]
+
+_bearer_scheme = HTTPBearer(auto_error=False)
+
+def _create_token(username, email, token_type, expires_in):
+    now = datetime.utcnow()
+    claims = {
+        "sub": username,
+        "email": email,
+        "type": token_type,
+        "iat": now,
+        "exp": now + expires_in,
+    }
+    return jwt.encode(claims, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
+
+def create_access_token(username, email):
+    return _create_token(username, email, ACCESS_TOKEN_TYPE, timedelta(minutes=ACCESS_TOKEN_EXPIRY_MINUTES))
+
+def create_refresh_token(username, email):
+    return _create_token(username, email, REFRESH_TOKEN_TYPE, timedelta(days=REFRESH_TOKEN_EXPIRY_DAYS))
+
+def issue_tokens(username, email):
+    return {
+        "access_token": create_access_token(username, email),
+        "refresh_token": create_refresh_token(username, email),
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRY_MINUTES * 60,
+    }
+
+def decode_token(token, expected_type=ACCESS_TOKEN_TYPE):
+    """Validate signature, expiry and token type locally; raises 401 on any failure."""
+    for key in _VERIFICATION_KEYS:
+        try:
+            claims = jwt.decode(token, key, algorithms=[JWT_ALGORITHM])
+        except ExpiredSignatureError:
+            raise HTTPException(status_code=401, detail="Token expired", headers={"WWW-Authenticate": "Bearer"})
+        except JWTError:
+            continue
+        if claims.get("type") != expected_type or not claims.get("sub"):
+            break
+        return claims
+    raise HTTPException(status_code=401, detail="Invalid token", headers={"WWW-Authenticate": "Bearer"})
+
+def optional_token_claims(credentials: Optional[HTTPAuthorizationCredentials] = Depends(_bearer_scheme)):
+    """Claims of the bearer access token, or None when the request carries no token.
+
+    Tokens are optional so existing clients keep working; a token that is present must be valid.
+    """
+    if credentials is None:
+        return None
+    return decode_token(credentials.credentials)
+
+def check_token_subject(username, claims):
+    """Reject a token issued for a different user than the one the request is about."""
+    if claims is not None and claims["sub"] != username:
+        logger.warning(f"Token for {claims['sub']} used on {username}")
+        raise HTTPException(status_code=403, detail="Token does not match user")
+
+async def ensure_user_exists(username, claims=None):
+    """Existence check that trusts a valid token for the same user instead of querying Mongo."""
+    check_token_subject(username, claims)
+    if claims is not None:
+        return
+    if not await get_user_by_username(username, USER_EXISTS_PROJECTION):
+        logger.warning(f"User not found: {username}")
+        raise HTTPException(status_code=404, detail="User not found")
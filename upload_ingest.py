@@ -0,0 +1,226 @@
+from fastapi import HTTPException
+from PIL import Image, ImageOps
+from image_preprocessing import (
+    MAX_UPLOAD_BYTES, MAX_IMAGE_PIXELS, ImagePreprocessingError, ImageTooLargeError, InvalidImageError,
+)
+import hashlib
+import io
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Every image upload is read exactly once through ingest_upload(): chunks are hashed as they
+# arrive, the byte limit is enforced per chunk, the format is checked from the magic bytes of
+# the first chunk and the pixel limit from the image header, before the rest is read. The
+# result is one buffer (in memory, or a temp file above UPLOAD_SPOOL_MAX_MEMORY_BYTES) that
+# storage and the CNN read independently through IngestedUpload.open().
+UPLOAD_CHUNK_SIZE = 64 * 1024
+THUMBNAIL_MAX_SIZE = int(os.getenv("THUMBNAIL_MAX_SIZE", "512"))
+THUMBNAIL_JPEG_QUALITY = int(os.getenv("THUMBNAIL_JPEG_QUALITY", "85"))
+UPLOAD_SPOOL_MAX_MEMORY_BYTES = int(os.getenv("UPLOAD_SPOOL_MAX_MEMORY_BYTES", str(2 * 1024 * 1024)))
+ALLOWED_IMAGE_TYPES = {
+    image_type.strip() for image_type in os.getenv("ALLOWED_IMAGE_TYPES", "jpeg,png,webp").split(",") if image_type.strip()
+}
+
+class EmptyUploadError(InvalidImageError):
+    pass
+
+class UnsupportedImageTypeError(InvalidImageError):
+    pass
+
+def detect_image_type(header: bytes):
+    """Image format from the leading magic bytes, or None if it is not one we recognise."""
+    if header.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if header[:2] == b"BM":
+        return "bmp"
+    return None
+
+def _image_size(source):
+    """(width, height) from the image header in source (file object or path), or None if it can't be parsed yet."""
+    try:
+        with Image.open(source) as image:
+            return image.size
+    except Exception:
+        return None
+
+class IngestedUpload:
+    """A fully read, validated upload that several consumers can read without sharing a position."""
+
+    def __init__(self, filename, image_type, sha256, size, width, height, data=None, path=None):
+        self.filename = filename
+        self.image_type = image_type
+        self.sha256 = sha256
+        self.size = size
+        self.width = width
+        self.height = height
+        self._data = data
+        self._path = path
+        self._thumbnail = None
+
+    @property
+    def spooled_to_disk(self):
+        return self._path is not None
+
+    def open(self):
+        """A new independent file object over the upload (no copy for in-memory uploads)."""
+        if self._path is not None:
+            return open(self._path, "rb")
+        return io.BytesIO(self._data)
+
+    def read_bytes(self):
+        if self._path is not None:
+            with open(self._path, "rb") as f:
+                return f.read()
+        return self._data
+
+    def thumbnail(self, max_size=THUMBNAIL_MAX_SIZE):
+        """JPEG bytes of the image scaled to fit max_size x max_size; generated once, then reused."""
+        if self._thumbnail is None:
+            with self.open() as image_file, Image.open(image_file) as image:
+                # Lets libjpeg decode at a reduced scale that is still >= the thumbnail size
+                image.draft("RGB", (max_size, max_size))
+                # The JPEG is saved without EXIF, so bake the orientation in (portrait phone photos)
+                image = ImageOps.exif_transpose(image).convert("RGB")
+                image.thumbnail((max_size, max_size))
+                buffer = io.BytesIO()
+                image.save(buffer, format="JPEG", quality=THUMBNAIL_JPEG_QUALITY, optimize=True)
+            self._thumbnail = buffer.getvalue()
+        return self._thumbnail
+
+    def close(self):
+        if self._path is not None:
+            try:
+                os.remove(self._path)
+            except FileNotFoundError:
+                pass
+            self._path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+async def ingest_upload(upload_file, max_bytes=MAX_UPLOAD_BYTES, max_pixels=MAX_IMAGE_PIXELS,
+                        allowed_types=None, spool_max_memory=UPLOAD_SPOOL_MAX_MEMORY_BYTES):
+    """Stream a FastAPI UploadFile into an IngestedUpload, failing as early as possible.
+
+    Raises EmptyUploadError, UnsupportedImageTypeError, ImageTooLargeError (bytes or pixels)
+    or InvalidImageError.
+    """
+    allowed_types = ALLOWED_IMAGE_TYPES if allowed_types is None else allowed_types
+    declared_size = getattr(upload_file, "size", None)
+    if declared_size is not None and declared_size > max_bytes:
+        raise ImageTooLargeError(f"Upload exceeds {max_bytes} bytes")
+
+    digest = hashlib.sha256()
+    buffer = bytearray()
+    spool = None
+    size = 0
+    header = b""
+    image_type = None
+    dimensions = None
+    # A failed header parse usually means the header isn't complete yet (large EXIF/ICC blocks
+    # come before the JPEG size). Each retry waits for the upload to double, so parsing costs
+    # O(size) overall. The final attempt, with every byte present, decides.
+    next_parse_at = 0
+
+    def read_dimensions():
+        if spool is None:
+            return _image_size(io.BytesIO(buffer))
+        spool.flush()
+        return _image_size(spool.name)
+
+    def check_dimensions():
+        if dimensions and dimensions[0] * dimensions[1] > max_pixels:
+            raise ImageTooLargeError(f"Image is {dimensions[0]}x{dimensions[1]}, limit is {max_pixels} pixels")
+
+    def check_type():
+        if image_type not in allowed_types:
+            raise UnsupportedImageTypeError(f"Unsupported image type; allowed: {', '.join(sorted(allowed_types))}")
+
+    try:
+        while True:
+            chunk = await upload_file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise ImageTooLargeError(f"Upload exceeds {max_bytes} bytes")
+            digest.update(chunk)
+
+            if spool is None:
+                buffer.extend(chunk)
+                if len(buffer) > spool_max_memory:
+                    spool = tempfile.NamedTemporaryFile(prefix="skiniq-upload-", delete=False)
+                    spool.write(buffer)
+                    buffer = bytearray()
+            else:
+                spool.write(chunk)
+
+            if image_type is None:
+                header += chunk[:12 - len(header)]
+                if len(header) < 12:
+                    continue
+                image_type = detect_image_type(header)
+                check_type()
+            if dimensions is None and size >= next_parse_at:
+                dimensions = read_dimensions()
+                check_dimensions()
+                next_parse_at = size * 2
+
+        if size == 0:
+            raise EmptyUploadError("File is empty")
+        if image_type is None:
+            image_type = detect_image_type(header)
+            check_type()
+        if dimensions is None:
+            dimensions = read_dimensions()
+            check_dimensions()
+        if dimensions is None:
+            raise InvalidImageError("Unsupported or corrupt image: could not read the image header")
+    except BaseException:
+        if spool is not None:
+            spool.close()
+            os.remove(spool.name)
+        raise
+
+    path = None
+    if spool is not None:
+        spool.close()
+        path = spool.name
+    return IngestedUpload(
+        filename=getattr(upload_file, "filename", None),
+        image_type=image_type,
+        sha256=digest.hexdigest(),
+        size=size,
+        width=dimensions[0],
+        height=dimensions[1],
+        data=bytes(buffer) if path is None else None,
+        path=path,
+    )
+
+def upload_http_error(error: ImagePreprocessingError):
+    """The HTTP error an upload validation failure should be reported as."""
+    if isinstance(error, ImageTooLargeError):
+        return HTTPException(status_code=413, detail=str(error))
+    if isinstance(error, UnsupportedImageTypeError):
+        return HTTPException(status_code=415, detail=str(error))
+    return HTTPException(status_code=400, detail=str(error))
+
+async def ingest_image_upload(upload_file, **limits):
+    """ingest_upload() for route handlers: validation failures become 400/413/415 responses."""
+    try:
+        return await ingest_upload(upload_file, **limits)
+    except ImagePreprocessingError as e:
+        logger.warning(f"Rejected upload {getattr(upload_file, 'filename', None)}: {e}")
+        raise upload_http_error(e)
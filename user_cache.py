@@ -0,0 +1,122 @@
+from bson import json_util
+from cache import TTLCache, TieredCache, create_shared_cache
+from executor import get_executor
+import asyncio
+import copy
+import functools
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Read-through cache for user documents, invalidated by the update functions in
+# mongo_utils.py / mongo_async.py. With several app processes the in-process tier can
+# serve a stale document for up to USER_CACHE_TTL_SECONDS, so keep it short; the shared
+# tier (USER_CACHE_SHARED_URL, "redis://..." or "memory://") is invalidated for everyone.
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+USER_CACHE_SHARED_URL = os.getenv("USER_CACHE_SHARED_URL", "")
+
+user_cache = TieredCache(
+    TTLCache(max_size=USER_CACHE_MAX_SIZE, ttl_seconds=USER_CACHE_TTL_SECONDS),
+    create_shared_cache(USER_CACHE_SHARED_URL, prefix="skiniq:user:", serializer=json_util),
+)
+
+# Documents carrying credentials (bcrypt hash, live OTP) are never cached, in either tier
+SENSITIVE_FIELDS = ("password", "otp")
+
+# Each cached user is stored under "<field>:<value>" as {projection key: document}. An
+# "alias:<other field>:<other value>" entry points back at it, so an update made by email
+# also drops the entry cached by username and vice versa.
+_OTHER_FIELD = {"username": "email", "email": "username"}
+
+def _projection_key(projection):
+    return json.dumps(projection, sort_keys=True) if projection else "*"
+
+def cacheable_projection(projection):
+    """Make sure inclusion projections also return username and email, which the aliases need."""
+    if not projection:
+        return projection
+    if any(not value for field, value in projection.items() if field != "_id"):
+        return projection  # exclusion projection: both fields are already included
+    return {**projection, "username": 1, "email": 1}
+
+# Invalidation generations stop the read-through from re-caching a document that was read
+# before an update: lookups take user_cache_generation() before querying, and cache_user()
+# drops the fill if either of the user's keys was invalidated since. Keys share a fixed
+# number of slots, so a collision only costs a skipped fill. Only this process's updates
+# are seen; reads whose result is written back should bypass the cache (cached=False).
+_GENERATION_SLOTS = 4096
+_generations = [0] * _GENERATION_SLOTS
+_generation = 0
+_generation_lock = threading.Lock()
+
+def user_cache_generation():
+    return _generation
+
+def _bump_generation(key):
+    global _generation
+    with _generation_lock:
+        _generation += 1
+        _generations[hash(key) % _GENERATION_SLOTS] = _generation
+
+def _invalidated_since(keys, generation):
+    return any(_generations[hash(key) % _GENERATION_SLOTS] > generation for key in keys)
+
+def get_cached_user(field, value, projection=None):
+    entry = user_cache.get(f"{field}:{value}")
+    if entry is None:
+        return None
+    user = entry.get(_projection_key(projection))
+    return copy.deepcopy(user) if user is not None else None
+
+def cache_user(field, value, projection, user, generation=None):
+    """Cache a looked-up user; generation is user_cache_generation() from before the read."""
+    if not user or any(sensitive in user for sensitive in SENSITIVE_FIELDS):
+        return
+    key = f"{field}:{value}"
+    other_field = _OTHER_FIELD[field]
+    watched = [key] + ([f"{other_field}:{user[other_field]}"] if user.get(other_field) else [])
+    if generation is not None and _invalidated_since(watched, generation):
+        return
+    entry = dict(user_cache.get(key) or {})
+    entry[_projection_key(projection)] = copy.deepcopy(user)
+    user_cache.set(key, entry)
+    if user.get(other_field):
+        user_cache.set(f"alias:{other_field}:{user[other_field]}", value)
+    # An invalidation that landed between the check and the set has already run its delete
+    if generation is not None and _invalidated_since(watched, generation):
+        user_cache.delete(key)
+
+def invalidate_user(field, value):
+    _bump_generation(f"{field}:{value}")
+    user_cache.delete(f"{field}:{value}")
+    alias_key = f"alias:{field}:{value}"
+    other_value = user_cache.get(alias_key)
+    if other_value is not None:
+        user_cache.delete(f"{_OTHER_FIELD[field]}:{other_value}")
+        user_cache.delete(alias_key)
+
+# Async variants for mongo_async.py. The shared tier does blocking network round-trips, so
+# with one configured the calls run on the blocking executor instead of the event loop. They
+# skip run_blocking's 429 limit: each call is bounded by the shared cache's socket timeout and
+# a cache operation must never fail the request it serves.
+async def _off_loop(func, *args):
+    if user_cache.shared is None:
+        return func(*args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args))
+
+async def get_cached_user_async(field, value, projection=None):
+    return await _off_loop(get_cached_user, field, value, projection)
+
+async def cache_user_async(field, value, projection, user, generation=None):
+    await _off_loop(cache_user, field, value, projection, user, generation)
+
+async def invalidate_user_async(field, value):
+    await _off_loop(invalidate_user, field, value)
+
+def user_cache_stats():
+    return user_cache.stats()
@@ -0,0 +1,170 @@
+from bson import ObjectId, json_util
+from pymongo.errors import BulkWriteError
+from mongo_utils import build_skin_analysis_doc
+import asyncio
+import glob
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Skin analysis history is written behind the request: documents are buffered and inserted with
+# insert_many once SKIN_ANALYSIS_WRITE_BATCH_SIZE are pending or every
+# SKIN_ANALYSIS_WRITE_INTERVAL_SECONDS. The buffer is drained on shutdown; anything that still
+# cannot be written is spilled to WRITE_BEHIND_SPILL_PATH and replayed on the next startup.
+# Each process spills to its own "<path>.<pid>" file. At startup a worker claims every spill
+# file by renaming it, so uvicorn workers sharing the directory never replay one file twice.
+SKIN_ANALYSIS_WRITE_BATCH_SIZE = int(os.getenv("SKIN_ANALYSIS_WRITE_BATCH_SIZE", "100"))
+SKIN_ANALYSIS_WRITE_INTERVAL_SECONDS = float(os.getenv("SKIN_ANALYSIS_WRITE_INTERVAL_SECONDS", "1.0"))
+SKIN_ANALYSIS_WRITE_MAX_PENDING = int(os.getenv("SKIN_ANALYSIS_WRITE_MAX_PENDING", "10000"))
+WRITE_BEHIND_SPILL_PATH = os.getenv("WRITE_BEHIND_SPILL_PATH", "write_behind_spill.jsonl")
+WRITE_BEHIND_DRAIN_ATTEMPTS = 3
+
+DUPLICATE_KEY_ERROR = 11000
+
+class WriteBehindBuffer:
+    def __init__(self, insert_many, batch_size=SKIN_ANALYSIS_WRITE_BATCH_SIZE,
+                 interval=SKIN_ANALYSIS_WRITE_INTERVAL_SECONDS, max_pending=SKIN_ANALYSIS_WRITE_MAX_PENDING,
+                 spill_path=WRITE_BEHIND_SPILL_PATH, name="skin_analysis"):
+        self.insert_many = insert_many
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        self.max_pending = max_pending
+        self.spill_path = spill_path
+        self.name = name
+        self._pending = []
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self.flushed = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def enqueue(self, doc):
+        """Buffer a document; returns False (caller should write it directly) when the buffer is full or stopped."""
+        if not self.running or len(self._pending) >= self.max_pending:
+            return False
+        # Assign the _id up front so a retried insert_many cannot create duplicates
+        doc.setdefault("_id", ObjectId())
+        self._pending.append(doc)
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    async def start(self):
+        if self.running:
+            return
+        self._replay_spill()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Started {self.name} write-behind buffer (batch {self.batch_size}, interval {self.interval}s)")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._pending:
+                if not await self.flush():
+                    break  # keep the documents and retry on the next tick
+                if len(self._pending) < self.batch_size:
+                    break
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return True
+            batch = self._pending[:self.batch_size]
+            try:
+                await self.insert_many(batch)
+            except BulkWriteError as e:
+                # Documents already inserted by an earlier, partially failed attempt are fine
+                errors = e.details.get("writeErrors", [])
+                if any(error.get("code") != DUPLICATE_KEY_ERROR for error in errors):
+                    self.failed_flushes += 1
+                    logger.error(f"{self.name} write-behind flush failed: {e}")
+                    return False
+            except Exception as e:
+                self.failed_flushes += 1
+                logger.error(f"{self.name} write-behind flush of {len(batch)} documents failed: {e}")
+                return False
+            del self._pending[:len(batch)]
+            self.flushed += len(batch)
+            self.flushes += 1
+            return True
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        attempts = 0
+        while self._pending and attempts < WRITE_BEHIND_DRAIN_ATTEMPTS:
+            if not await self.flush():
+                attempts += 1
+        if self._pending:
+            self._spill()
+        logger.info(f"Stopped {self.name} write-behind buffer")
+
+    def _spill(self):
+        path = f"{self.spill_path}.{os.getpid()}"
+        with open(path, "a", encoding="utf-8") as f:
+            for doc in self._pending:
+                f.write(json_util.dumps(doc) + "\n")
+        logger.error(f"Spilled {len(self._pending)} unwritten {self.name} documents to {path}")
+        self._pending.clear()
+
+    def _replay_spill(self):
+        if not self.spill_path:
+            return
+        # The bare path is what spills were named before they became per-process
+        candidates = [self.spill_path] + glob.glob(glob.escape(self.spill_path) + ".*")
+        for index, path in enumerate(candidates):
+            if ".replaying-" in path:
+                continue  # claimed by a worker that is replaying it right now
+            claimed = f"{self.spill_path}.replaying-{os.getpid()}-{index}"
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue  # absent, or another worker claimed it first
+            with open(claimed, "r", encoding="utf-8") as f:
+                docs = [json_util.loads(line) for line in f if line.strip()]
+            os.remove(claimed)
+            self._pending.extend(docs)
+            logger.info(f"Replaying {len(docs)} spilled {self.name} documents from {path}")
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "pending": len(self._pending),
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "batch_size": self.batch_size,
+            "interval_seconds": self.interval,
+        }
+
+_skin_analysis_writer = None
+
+def get_skin_analysis_writer():
+    global _skin_analysis_writer
+    if _skin_analysis_writer is None:
+        from mongo_async import store_skin_analyses
+        _skin_analysis_writer = WriteBehindBuffer(store_skin_analyses)
+    return _skin_analysis_writer
+
+async def record_skin_analysis(username, skin_type, skin_info, image_url=None, description=None):
+    """Queue a skin analysis history document, writing it directly if the buffer can't take it."""
+    doc = build_skin_analysis_doc(username, skin_type, skin_info, image_url, description)
+    if get_skin_analysis_writer().enqueue(doc):
+        return
+    from mongo_async import store_skin_analyses
+    await store_skin_analyses([doc])
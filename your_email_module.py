@@ -1,20 +1,40 @@
 import random
 import smtplib
+import queue
+import threading
+import time
+import logging
+from collections import deque
+from string import Template
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import os
 from dotenv import load_dotenv
+from metrics import span, callback_gauge
 
 load_dotenv()
 
-def send_verification_email(email: str, otp: str, username: str):
-    sender_email = os.getenv("EMAIL_HOST_USER")
-    password = os.getenv("EMAIL_HOST_PASSWORD")
-    receiver_email = email
-
-    subject = "🌿 Your SKINIQ Verification Code is Here!"
-
-    body = f"""
+logger = logging.getLogger(__name__)
+
+# Outbound mail settings. Point EMAIL_SMTP_HOST/PORT at a local sink (see local_smtp.py)
+# with EMAIL_USE_TLS=0 to run without Gmail.
+EMAIL_SMTP_HOST = os.getenv("EMAIL_SMTP_HOST", "smtp.gmail.com")
+EMAIL_SMTP_PORT = int(os.getenv("EMAIL_SMTP_PORT", "587"))
+EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS", "1") == "1"
+EMAIL_SMTP_TIMEOUT_SECONDS = float(os.getenv("EMAIL_SMTP_TIMEOUT_SECONDS", "30"))
+EMAIL_SMTP_DEBUG = int(os.getenv("EMAIL_SMTP_DEBUG", "0"))
+# Number of sender threads, each holding at most one persistent SMTP connection
+EMAIL_POOL_SIZE = int(os.getenv("EMAIL_POOL_SIZE", "2"))
+EMAIL_QUEUE_MAX = int(os.getenv("EMAIL_QUEUE_MAX", "1000"))
+EMAIL_RETRY_AFTER_SECONDS = os.getenv("EMAIL_RETRY_AFTER_SECONDS", "30")
+EMAIL_MAX_RETRIES = int(os.getenv("EMAIL_MAX_RETRIES", "3"))
+EMAIL_RETRY_BACKOFF_SECONDS = float(os.getenv("EMAIL_RETRY_BACKOFF_SECONDS", "1.0"))
+# Idle connections are checked with NOOP before reuse; servers drop them after a while
+EMAIL_CONNECTION_MAX_IDLE_SECONDS = float(os.getenv("EMAIL_CONNECTION_MAX_IDLE_SECONDS", "60"))
+
+# Templates are parsed once at import; sending only substitutes the per-user fields
+VERIFICATION_SUBJECT = "🌿 Your SKINIQ Verification Code is Here!"
+VERIFICATION_TEMPLATE = Template("""
     <html>
       <body style="font-family: 'Segoe UI', sans-serif; background-color: #f2fdf9; color: #2f4f4f;">
         <div style="max-width: 600px; margin: auto; padding: 20px; border-radius: 12px; border: 1px solid #b2dfdb; background: #ffffff;">
@@ -25,14 +45,14 @@ def send_verification_email(email: str, otp: str, username: str):
             <p style="color: #219150; font-size: 14px; margin-top: 5px;"><em>Your Skin Our Care</em></p>
           </div>
 
-          <h2 style="color: #27ae60;">Hi {username}! 🌿</h2>
+          <h2 style="color: #27ae60;">Hi $username! 🌿</h2>
 
           <p>We're absolutely thrilled to have you on board with <strong>SKINIQ</strong> – your new skincare BFF! 🍃</p>
 
           <p style="font-size: 18px; color: #333;">
             Your One-Time Password (OTP) is:  
             <span style="display: inline-block; background: #d4eee7; padding: 10px 20px; border-radius: 8px; font-weight: bold; font-size: 22px; color: #2c7a67;">
-              {otp}
+              $otp
             </span>
           </p>
 
@@ -60,35 +80,10 @@ def send_verification_email(email: str, otp: str, username: str):
         </div>
       </body>
     </html>
-    """
-
-    message = MIMEMultipart()
-    message["From"] = sender_email
-    message["To"] = receiver_email
-    message["Subject"] = subject
-    message["Reply-To"] = sender_email
-    message.attach(MIMEText(body, "html", "utf-8"))
-
-    try:
-        server = smtplib.SMTP("smtp.gmail.com", 587)
-        server.set_debuglevel(1)  # For logs
-        server.starttls()
-        server.login(sender_email, password)
-        server.sendmail(sender_email, receiver_email, message.as_string())
-        server.quit()
-        print(f"✅ Verification email sent to {receiver_email}")
-    except Exception as e:
-        print(f"❌ Error sending email: {e}")
-
-
-def send_password_reset_email(email: str, username: str, reset_link: str):
-    sender_email = os.getenv("EMAIL_HOST_USER")
-    password = os.getenv("EMAIL_HOST_PASSWORD")
-    receiver_email = email
-
-    subject = "🔐 Reset Your SKINIQ Password Securely"
+    """)
 
-    body = f"""
+PASSWORD_RESET_SUBJECT = "🔐 Reset Your SKINIQ Password Securely"
+PASSWORD_RESET_TEMPLATE = Template("""
     <html>
       <body style="font-family: 'Segoe UI', sans-serif; background-color: #f2fdf9; color: #2f4f4f;">
         <div style="max-width: 600px; margin: auto; padding: 20px; border-radius: 12px; border: 1px solid #b2dfdb; background: #ffffff;">
@@ -99,20 +94,20 @@ def send_password_reset_email(email: str, username: str, reset_link: str):
             <p style="color: #219150; font-size: 14px; margin-top: 5px;"><em>Your Skin Our Care</em></p>
           </div>
 
-          <h2 style="color: #27ae60;">Hi {username}! 🔐</h2>
+          <h2 style="color: #27ae60;">Hi $username! 🔐</h2>
 
           <p>Looks like you requested a password reset for your SKINIQ account.</p>
 
           <p>Click the button below to reset your password:</p>
 
           <div style="text-align: center; margin: 30px 0;">
-            <a href="{reset_link}" style="background-color: #27ae60; color: #ffffff; padding: 12px 24px; border-radius: 8px; text-decoration: none; font-weight: bold; font-size: 16px;">
+            <a href="$reset_link" style="background-color: #27ae60; color: #ffffff; padding: 12px 24px; border-radius: 8px; text-decoration: none; font-weight: bold; font-size: 16px;">
               Reset My Password
             </a>
           </div>
 
           <p>If the button doesn't work, you can also use this link:</p>
-          <p style="word-break: break-all;"><a href="{reset_link}">{reset_link}</a></p>
+          <p style="word-break: break-all;"><a href="$reset_link">$reset_link</a></p>
 
           <p style="color: #888;">This link will expire in 30 minutes for your security.</p>
 
@@ -126,22 +121,207 @@ def send_password_reset_email(email: str, username: str, reset_link: str):
         </div>
       </body>
     </html>
-    """
-
-    message = MIMEMultipart()
-    message["From"] = sender_email
-    message["To"] = receiver_email
-    message["Subject"] = subject
-    message["Reply-To"] = sender_email
-    message.attach(MIMEText(body, "html", "utf-8"))
-
-    try:
-        server = smtplib.SMTP("smtp.gmail.com", 587)
-        server.set_debuglevel(1)
-        server.starttls()
-        server.login(sender_email, password)
-        server.sendmail(sender_email, receiver_email, message.as_string())
-        server.quit()
-        print(f"✅ Password reset email sent to {receiver_email}")
-    except Exception as e:
-        print(f"❌ Error sending password reset email: {e}")
+    """)
+
+class SMTPConnectionPool:
+    """Keeps logged-in SMTP connections open between messages and reconnects when they drop."""
+
+    def __init__(self, host=EMAIL_SMTP_HOST, port=EMAIL_SMTP_PORT, use_tls=EMAIL_USE_TLS,
+                 max_idle_seconds=EMAIL_CONNECTION_MAX_IDLE_SECONDS):
+        self.host = host
+        self.port = port
+        self.use_tls = use_tls
+        self.max_idle_seconds = max_idle_seconds
+        self._idle = queue.LifoQueue()
+        self.connections_opened = 0
+
+    def _connect(self):
+        sender_email = os.getenv("EMAIL_HOST_USER")
+        if not sender_email:
+            raise ValueError("EMAIL_HOST_USER is not set; there is no sender address")
+        with span("smtp_connect"):
+            server = smtplib.SMTP(self.host, self.port, timeout=EMAIL_SMTP_TIMEOUT_SECONDS)
+            server.set_debuglevel(EMAIL_SMTP_DEBUG)
+            if self.use_tls:
+                server.starttls()
+            password = os.getenv("EMAIL_HOST_PASSWORD")
+            if sender_email and password:
+                server.login(sender_email, password)
+        self.connections_opened += 1
+        logger.info(f"Opened SMTP connection to {self.host}:{self.port}")
+        return server
+
+    def acquire(self):
+        while True:
+            try:
+                server, idle_since = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if time.monotonic() - idle_since < self.max_idle_seconds:
+                return server
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            self.discard(server)
+
+    def release(self, server):
+        self._idle.put((server, time.monotonic()))
+
+    def discard(self, server):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def close(self):
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self.discard(server)
+
+class EmailQueue:
+    """Background sender: enqueue() returns immediately, worker threads deliver with retries."""
+
+    def __init__(self, pool=None, workers=EMAIL_POOL_SIZE, max_queue=EMAIL_QUEUE_MAX,
+                 max_retries=EMAIL_MAX_RETRIES, backoff_seconds=EMAIL_RETRY_BACKOFF_SECONDS):
+        self.pool = pool or SMTPConnectionPool()
+        self.workers = max(1, workers)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stop_deadline = None  # set by stop(); senders exit once it passes
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        # (receiver, subject, last error) for the most recent undeliverable messages
+        self.recent_failures = deque(maxlen=100)
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._stop_deadline = None
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"email-sender-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        logger.info(f"Started email queue with {self.workers} senders")
+
+    def enqueue(self, receiver_email, subject, body):
+        self.start()
+        # Raises queue.Full when the backlog is at EMAIL_QUEUE_MAX rather than growing without bound
+        self._queue.put_nowait((receiver_email, subject, body))
+
+    def is_full(self):
+        return self._queue.full()
+
+    def _send(self, server, receiver_email, subject, body):
+        sender_email = os.getenv("EMAIL_HOST_USER")
+        if not sender_email:
+            raise ValueError("EMAIL_HOST_USER is not set; there is no sender address")
+        message = MIMEMultipart()
+        message["From"] = sender_email
+        message["To"] = receiver_email
+        message["Subject"] = subject
+        message["Reply-To"] = sender_email
+        message.attach(MIMEText(body, "html", "utf-8"))
+        with span("smtp_send"):
+            server.sendmail(sender_email, receiver_email, message.as_string())
+
+    def _deliver(self, receiver_email, subject, body):
+        """None once sent, otherwise the last error after all retries."""
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.retried += 1
+                time.sleep(self.backoff_seconds * (2 ** (attempt - 1)))
+            server = None
+            try:
+                server = self.pool.acquire()
+                self._send(server, receiver_email, subject, body)
+                self.pool.release(server)
+                return None
+            except Exception as e:
+                error = e
+                if server is not None:
+                    self.pool.discard(server)
+                logger.warning(f"Email to {receiver_email} failed (attempt {attempt + 1}/{self.max_retries + 1}): {e}")
+        return error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if self._stop_deadline is not None and time.monotonic() >= self._stop_deadline:
+                    logger.error(f"Email queue stop timed out, dropping {self._queue.qsize() + 1} unsent emails")
+                    return
+                receiver_email, subject, body = item
+                error = self._deliver(receiver_email, subject, body)
+                if error is None:
+                    self.sent += 1
+                    logger.info(f"Email sent to {receiver_email}: {subject}")
+                else:
+                    self.failed += 1
+                    self.recent_failures.append((receiver_email, subject, str(error)))
+                    logger.error(f"Giving up on email to {receiver_email}: {subject}: {error}")
+            finally:
+                self._queue.task_done()
+
+    def stop(self, timeout=30):
+        """Wait for queued messages to be sent (up to timeout), then stop the senders."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        if not threads:
+            return
+        deadline = time.monotonic() + timeout
+        self._stop_deadline = deadline
+        for _ in threads:
+            # A full backlog can't take the sentinel before the deadline; the senders then
+            # stop on _stop_deadline instead
+            try:
+                self._queue.put(None, timeout=max(0, deadline - time.monotonic()))
+            except queue.Full:
+                break
+        for thread in threads:
+            thread.join(timeout=max(0, deadline - time.monotonic()))
+        self.pool.close()
+        logger.info("Email queue stopped")
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "connections_opened": self.pool.connections_opened,
+        }
+
+email_queue = EmailQueue()
+callback_gauge("skiniq_email_queue_depth", "Emails waiting to be sent", lambda: email_queue.stats()["queued"])
+
+def send_verification_email(email: str, otp: str, username: str):
+    body = VERIFICATION_TEMPLATE.substitute(username=username, otp=otp)
+    email_queue.enqueue(email, VERIFICATION_SUBJECT, body)
+    logger.info(f"Verification email queued for {email}")
+
+
+def send_password_reset_email(email: str, username: str, reset_link: str):
+    body = PASSWORD_RESET_TEMPLATE.substitute(username=username, reset_link=reset_link)
+    email_queue.enqueue(email, PASSWORD_RESET_SUBJECT, body)
+    logger.info(f"Password reset email queued for {email}")
+
+def stop_email_queue(timeout=30):
+    email_queue.stop(timeout=timeout)